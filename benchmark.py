@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+import matplotlib
+matplotlib.use("Agg")
+
+from src.parameters import getParam
+from src.synthetic_export import generateExport
+from src.zip_extraction import getDataFrame, getDates, getMessageLengths
+from src.anonymize import changeNames
+
+USER = getParam('user')
+LANGUAGE = getParam('language')
+TIMEZONE = getParam('timezone')
+
+
+def timeStage(results: dict, stage: str, func, *args, **kwargs):
+    import matplotlib.pyplot as plt
+
+    startTime = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        results[stage] = {"seconds": time.perf_counter() - startTime}
+    except Exception as error:
+        result = None
+        results[stage] = {"error": "{}: {}".format(type(error).__name__, error)}
+
+    plt.close('all')
+    print("{:<45} {}".format(stage, results[stage]))
+
+    return result
+
+
+def benchmarkPlots(results: dict, data, save_dir: str, language: str, skip_diversity: bool = False):
+    from src import plots
+    from src.aggregates import getActivityCube
+
+    cube = timeStage(results, "getActivityCube", getActivityCube, data, USER)
+
+    cubeStages = [
+        ("plotMessagesInChats", plots.plotMessagesInChats,
+         dict(chats=15, user=USER)),
+        ("plotActivityOverTime", plots.plotActivityOverTime,
+         dict(user=USER, order=6)),
+        ("plotActivityForMostFrequentNonGroupChats", plots.plotActivityForMostFrequentNonGroupChats,
+         dict(chats=4, order=3)),
+        ("plotActivityOverWeek", plots.plotActivityOverWeek, dict(user=USER)),
+        ("plotActivityOverDay", plots.plotActivityOverDay, dict(user=USER)),
+    ]
+
+    for stage, plotFunction, kwargs in cubeStages:
+        timeStage(results, stage, plotFunction,
+                  cube, save_dir=save_dir, **kwargs)
+
+    plotStages = [
+        ("plotMessageLengthDistributionPerChat", plots.plotMessageLengthDistributionPerChat,
+         dict(user=USER)),
+        ("plotAverageMessageLength", plots.plotAverageMessageLength,
+         dict(user=USER, chats=20, messages_treshold=0.1)),
+        ("generateKeywordClouds", plots.generateKeywordClouds,
+         dict(user=USER, language=language, chats=3, clouds_subdir="wordclouds")),
+    ]
+
+    # the diversity rank loads the spaCy model, it is skipped with the diversity stages
+    if not skip_diversity:
+        plotStages.append(("plotLanguageDiversityRank", plots.plotLanguageDiversityRank,
+                           dict(user=USER, language=language, batch_size=500)))
+
+    for stage, plotFunction, kwargs in plotStages:
+        timeStage(results, stage, plotFunction,
+                  data.copy(), save_dir=save_dir, **kwargs)
+
+
+def getTopChatText(data):
+    noGroup = data[(data["chat_with"] != "GROUP") & (data["type"] == "Generic")]
+    noGroup = noGroup.dropna(subset=["content"])
+    chatCounts = noGroup["chat_with"].value_counts()
+    topChat = noGroup[noGroup["chat_with"] == chatCounts.index[0]]
+
+    corpus = [". ".join(chat["content"].astype(str).values)
+              for _, chat in noGroup.groupby("chat_with", observed=True)]
+
+    return ". ".join(topChat["content"].astype(str).values), corpus
+
+
+def referenceCleanText(text: str, following_character_limit: int = 2) -> str:
+    # character loop NGramExtractor.clean_text used before it moved to regex
+    noLinks = " ".join([word.lower() for word in text.split()
+                        if not word.startswith("http")])
+    if(following_character_limit == None):
+        return noLinks
+
+    noRepetitions = []
+    counter = 0
+    currchar = '\n'
+
+    for char in noLinks:
+        if char != currchar:
+            currchar = char
+            counter = 1
+            noRepetitions.append(char)
+            continue
+        if (counter < following_character_limit):
+            counter = counter+1
+            noRepetitions.append(char)
+
+    return "".join(noRepetitions)
+
+
+def checkCleanText(results: dict, corpus: list, language: str):
+    from src.n_gram_extractor import NGramExtractor
+
+    for limit in [None, 1, 2, 3]:
+        extractor = NGramExtractor(
+            language=language, following_character_limit=limit)
+        equal = all(extractor.clean_text(text) == referenceCleanText(text, limit)
+                    for text in corpus)
+
+        results["clean_text equivalence[limit={}]".format(limit)] = {
+            "equal": equal}
+        print("{:<45} {}".format("clean_text equivalence[limit={}]".format(limit), equal))
+
+
+def benchmarkKeywords(results: dict, data, language: str):
+    from src.n_gram_extractor import NGramExtractor
+
+    chatText, corpus = getTopChatText(data)
+
+    checkCleanText(results, corpus, language)
+
+    referenceExtractor = NGramExtractor(language=language)
+    timeStage(results, "clean_text (character loop)",
+              referenceCleanText, chatText, referenceExtractor.followingCharacterLimit)
+    timeStage(results, "NGramExtractor.clean_text",
+              referenceExtractor.clean_text, chatText)
+
+    extractor = timeStage(results, "NGramExtractor.initIDFCorpus", NGramExtractor,
+                          language=language, IDFCorpus=corpus, max_n=4)
+
+    for n_gram in range(1, 5):
+        timeStage(results, "NGramExtractor.analyze[n={}]".format(n_gram), extractor.analyze,
+                  chatText, n_gram=n_gram, keywords_number=20, window_size=4)
+
+
+def benchmarkDiversity(results: dict, data, language: str):
+    from src.language_diversity import getModel, calculateDiversity
+
+    chatText, _ = getTopChatText(data)
+    model = timeStage(results, "getModel", getModel, language=language)
+
+    if model != None:
+        doc = timeStage(results, "spacy model", model, chatText[:70000])
+        if doc != None:
+            timeStage(results, "calculateDiversity",
+                      calculateDiversity, doc, batch_size=500)
+
+
+def getFailedChecks(report: dict) -> list:
+    return [stage for stage, result in report["stages"].items()
+            if result.get("equal") == False]
+
+
+def runBenchmark(args) -> dict:
+    results = dict()
+
+    with tempfile.TemporaryDirectory() as workDir:
+        zipDir = os.path.join(workDir, "zips")
+        os.makedirs(zipDir)
+        zipPath = os.path.join(zipDir, "synthetic.zip")
+
+        timeStage(results, "generateExport", generateExport, zipPath, chats=args.chats,
+                  messages=args.messages, group_ratio=args.group_ratio, language=args.language, seed=args.seed)
+
+        data = timeStage(results, "parse", getDataFrame, zipPaths=[zipPath], user=USER,
+                         isAnonymous=False, workers=args.workers)
+        if data is None:
+            return {"stages": results}
+
+        data = timeStage(results, "getDates", getDates, data, TIMEZONE)
+        data = timeStage(results, "getMessageLengths",
+                         getMessageLengths, data)
+        timeStage(results, "anonymize", changeNames, data.copy(),
+                  names_map_file=None)
+
+        if not args.skip_plots:
+            benchmarkPlots(results, data, os.path.join(workDir, "figures"),
+                           args.language, args.skip_diversity)
+
+        benchmarkKeywords(results, data, args.language)
+
+        if not args.skip_diversity:
+            benchmarkDiversity(results, data, args.language)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": vars(args),
+        "messages": len(data),
+        "stages": results,
+    }
+
+
+def parseArguments(argv: list):
+    parser = argparse.ArgumentParser(
+        description="Time every stage of the analysis on a synthetic Messenger export.")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--group-ratio", type=float, default=0.2)
+    parser.add_argument("--language", default=LANGUAGE,
+                        choices=["polish", "english"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int,
+                        default=getParam('parsing')['workers'])
+    parser.add_argument("--skip-plots", action="store_true")
+    parser.add_argument("--skip-diversity", action="store_true")
+    parser.add_argument("--output", default="benchmark-results.json",
+                        help="JSON file the results are written to")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    if not sys.warnoptions:
+        import warnings
+        warnings.simplefilter("ignore")
+
+    args = parseArguments(sys.argv[1:])
+    report = runBenchmark(args)
+
+    with open(args.output, "w", encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    print("Results written to", args.output)
+
+    # a regression in an equivalence check fails the run, not only the report
+    failedChecks = getFailedChecks(report)
+    if len(failedChecks) > 0:
+        sys.exit("FAILED: " + ", ".join(failedChecks))
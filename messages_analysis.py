@@ -6,14 +6,15 @@ from src.zip_extraction import getMessages
 from src.plots_generation import generatePlots
 
 
-def runFullAnalysis():
+def runFullAnalysis(parse_only: bool = False):
     startTime = time.time()
 
     print("Parsing data")
     data = getMessages()
 
-    print("Generating plots")
-    generatePlots(data)
+    if not parse_only:
+        print("Generating plots")
+        generatePlots(data)
 
     print("Done")
     endTime = time.time()
@@ -25,4 +26,4 @@ if __name__ == "__main__":
         import warnings
         warnings.simplefilter("ignore")
 
-    runFullAnalysis()
+    runFullAnalysis(parse_only="--parse-only" in sys.argv)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+CUBE_DIMENSIONS = ["chat_with", "date", "hour",
+                   "weekday", "sent_by_user", "type"]
+
+
+def fillMissingCategory(column: pd.Series, fill: str) -> pd.Series:
+    column = column.astype('category')
+
+    if not column.isna().any():
+        return column
+
+    if fill not in column.cat.categories:
+        column = column.cat.add_categories([fill])
+
+    return column.fillna(fill)
+
+
+def getActivityCube(data: pd.DataFrame, user: str) -> pd.DataFrame:
+    keys = pd.DataFrame({
+        "chat_with": data["chat_with"].values,
+        "date": data["date"].values,
+        "hour": data["hour"].values,
+        "weekday": data["weekday"].values,
+        "sent_by_user": (data["sender_name"] == user).values,
+        # groupby drops missing keys, messages without type still count
+        "type": fillMissingCategory(data["type"], "Unknown").values,
+        "words": data["message_length"].values,
+    })
+
+    cube = keys.groupby(CUBE_DIMENSIONS, observed=True).agg(
+        messages=("words", "size"), words=("words", "sum")).reset_index()
+
+    return cube
+
+
+def getChatRanking(cube: pd.DataFrame) -> pd.Series:
+    ranking = cube.groupby("chat_with", observed=True)["messages"].sum()
+
+    return ranking[ranking > 0].sort_values(ascending=False)
+
+
+def getDaysNumber(cube: pd.DataFrame) -> int:
+    return (cube["date"].max() - cube["date"].min()).days + 1
+
+
+def getDirectionNames(sentByUser: pd.Series) -> np.ndarray:
+    return np.where(sentByUser, "Sent", "Received")
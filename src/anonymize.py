@@ -1,20 +1,80 @@
+import os
+import json
+import random
 import pandas as pd
 import names
 
+from .parameters import getParam
+from .utils import assertDir
 
-def getNamesDict(data: pd.DataFrame) -> dict:
-    realNames = set(data["chat_with"].value_counts().index)
-    realNames.remove("GROUP")
+SEED = getParam('anonymization')['seed']
+NAMES_MAP_FILE = getParam('anonymization')['namesMapFile']
 
-    namesMap = dict()
+ANONYMIZED_COLUMNS = ["sender_name", "chat_with"]
 
-    for realName in realNames:
+
+def loadNamesMap(names_map_file: str = NAMES_MAP_FILE) -> dict:
+    if not isinstance(names_map_file, str) or not os.path.exists(names_map_file):
+        return dict()
+
+    with open(names_map_file, "r", encoding='utf-8') as file:
+        return json.load(file)
+
+
+def saveNamesMap(namesMap: dict, names_map_file: str = NAMES_MAP_FILE):
+    if not isinstance(names_map_file, str):
+        return
+
+    directory = os.path.dirname(names_map_file)
+    if directory != '':
+        assertDir(directory)
+
+    with open(names_map_file, "w", encoding='utf-8') as file:
+        json.dump(namesMap, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def getNamesDict(data: pd.DataFrame, namesMap: dict = None, seed: int = SEED) -> dict:
+    realNames = set(data["chat_with"].unique())
+    realNames.discard("GROUP")
+
+    namesMap = dict() if namesMap == None else dict(namesMap)
+
+    presentNames = set()
+    for column in ANONYMIZED_COLUMNS:
+        presentNames.update(data[column].dropna().unique())
+
+    # a stored name equal to a name left unchanged, or to another stored name, would merge two people
+    keptNames = presentNames - realNames - set(namesMap.keys())
+    usedNames = set()
+    clashingNames = set()
+    for realName in sorted(namesMap.keys()):
+        if namesMap[realName] in keptNames or namesMap[realName] in usedNames:
+            clashingNames.add(realName)
+        usedNames.add(namesMap[realName])
+
+    for realName in clashingNames:
+        print("WARNING: Stored name " + namesMap[realName] +
+              " is taken, a new one is drawn")
+        del namesMap[realName]
+
+    takenNames = set(namesMap.values()) | presentNames
+
+    # names draws from the global generator, so it is reseeded and restored
+    state = random.getstate()
+    random.seed(seed)
+
+    for realName in sorted(realNames | clashingNames):
+        if realName in namesMap.keys():
+            continue
 
         newName = names.get_full_name()
-        while newName in namesMap.values():
+        while newName in takenNames:
             newName = names.get_full_name()
 
         namesMap[realName] = newName
+        takenNames.add(newName)
+
+    random.setstate(state)
 
     return namesMap
 
@@ -26,15 +86,13 @@ def changeName(name: str, namesMap: dict) -> str:
     return name
 
 
-def changeRow(row: pd.Series, namesMap: dict) -> pd.Series:
-    newRow = row.copy()
-    newRow['sender_name'] = changeName(newRow['sender_name'], namesMap)
-    newRow['chat_with'] = changeName(newRow['chat_with'], namesMap)
-
-    return newRow
-
+def changeNames(data: pd.DataFrame, seed: int = SEED, names_map_file: str = NAMES_MAP_FILE) -> pd.DataFrame:
+    namesMap = getNamesDict(data, loadNamesMap(names_map_file), seed)
+    saveNamesMap(namesMap, names_map_file)
 
-def changeNames(data: pd.DataFrame) -> pd.DataFrame:
-    namesMap = getNamesDict(data)
+    for column in ANONYMIZED_COLUMNS:
+        categorical = data[column].astype('category')
+        data[column] = categorical.cat.rename_categories(
+            lambda name: changeName(name, namesMap))
 
-    return data.apply(changeRow, axis=1, args=(namesMap,))
+    return data
@@ -0,0 +1,64 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+from .parameters import getParam
+from .utils import assertDir
+
+CACHE_DIR = getParam('cacheDirectory')
+CACHE_VERSION = 4
+MESSAGES_PREFIX = "messages-"
+
+
+def getSourceSignature(paths: list) -> list:
+    signature = list()
+
+    for path in sorted(paths):
+        stat = os.stat(path)
+        signature.append({"path": os.path.abspath(path),
+                          "size": stat.st_size,
+                          "mtime": stat.st_mtime})
+
+    return signature
+
+
+def getCacheKey(paths: list, settings: dict) -> str:
+    description = {"version": CACHE_VERSION,
+                   "sources": getSourceSignature(paths),
+                   "settings": settings}
+
+    serialized = json.dumps(description, sort_keys=True)
+
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def getCachePath(key: str, cache_dir: str = CACHE_DIR) -> str:
+    return os.path.join(cache_dir, MESSAGES_PREFIX + key + ".parquet")
+
+
+def loadMessages(key: str, cache_dir: str = CACHE_DIR) -> pd.DataFrame:
+    path = getCachePath(key, cache_dir)
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        return pd.read_parquet(path)
+    except Exception:
+        print("WARNING: Corrupted messages cache " + path)
+        return None
+
+
+def saveMessages(data: pd.DataFrame, key: str, cache_dir: str = CACHE_DIR):
+    assertDir(cache_dir)
+    path = getCachePath(key, cache_dir)
+
+    # only the newest parse is kept, older ones can not be hit anymore
+    for fileName in os.listdir(cache_dir):
+        if fileName.startswith(MESSAGES_PREFIX) and fileName.endswith(".parquet"):
+            os.remove(os.path.join(cache_dir, fileName))
+
+    temporaryPath = path + ".tmp"
+    data.to_parquet(temporaryPath, index=False)
+    os.replace(temporaryPath, path)
@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+from .utils import assertDir
+
+MANIFEST_VERSION = 2
+MANIFEST_FILE = "figures-manifest.json"
+
+
+def getFrameHash(data: pd.DataFrame) -> str:
+    rowHashes = pd.util.hash_pandas_object(data, index=False).values
+
+    description = [list(map(str, data.columns)), list(map(str, data.dtypes))]
+    digest = hashlib.sha1(json.dumps(description).encode('utf-8'))
+    digest.update(rowHashes.tobytes())
+
+    return digest.hexdigest()
+
+
+def getFigureHash(*parts) -> str:
+    serialized = json.dumps([MANIFEST_VERSION, parts], sort_keys=True,
+                            ensure_ascii=False, default=str)
+
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def loadManifest(save_dir: str) -> dict:
+    if not isinstance(save_dir, str):
+        return dict()
+
+    path = os.path.join(save_dir, MANIFEST_FILE)
+
+    if not os.path.exists(path):
+        return dict()
+
+    try:
+        with open(path, "r", encoding='utf-8') as file:
+            manifest = json.load(file)
+    except Exception:
+        print("WARNING: Corrupted figures manifest " + path)
+        return dict()
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return dict()
+
+    return manifest["figures"]
+
+
+def recordFigures(figureHashes: dict, save_dir: str):
+    if not isinstance(save_dir, str) or len(figureHashes) == 0:
+        return
+
+    # the manifest is read again, other figures may have been recorded meanwhile
+    figures = loadManifest(save_dir)
+    figures.update(figureHashes)
+
+    assertDir(save_dir)
+    path = os.path.join(save_dir, MANIFEST_FILE)
+
+    with open(path + ".tmp", "w", encoding='utf-8') as file:
+        json.dump({"version": MANIFEST_VERSION,
+                   "figures": figures}, file, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def getFigureKey(fullPath: str, save_dir: str) -> str:
+    return os.path.relpath(fullPath, save_dir).replace(os.sep, "/")
+
+
+def isFigureCurrent(figures: dict, fullPath: str, save_dir: str, figureHash: str) -> bool:
+    return figures.get(getFigureKey(fullPath, save_dir)) == figureHash and os.path.exists(fullPath)
@@ -0,0 +1,99 @@
+import os
+import json
+import zipfile
+import pandas as pd
+
+from .utils import assertDir
+from .schema import concatMessages
+
+STORE_VERSION = 2
+STORE_DATA_FILE = "message-store.parquet"
+STORE_MANIFEST_FILE = "message-store.json"
+
+
+def getEmptyManifest(user: str) -> dict:
+    return {"version": STORE_VERSION, "user": user, "files": dict()}
+
+
+def loadStore(cache_dir: str, user: str):
+    if not isinstance(cache_dir, str):
+        return None, getEmptyManifest(user)
+
+    dataPath = os.path.join(cache_dir, STORE_DATA_FILE)
+    manifestPath = os.path.join(cache_dir, STORE_MANIFEST_FILE)
+
+    if not (os.path.exists(dataPath) and os.path.exists(manifestPath)):
+        return None, getEmptyManifest(user)
+
+    with open(manifestPath, "r", encoding='utf-8') as file:
+        manifest = json.load(file)
+
+    if manifest.get("version") != STORE_VERSION or manifest.get("user") != user:
+        return None, getEmptyManifest(user)
+
+    try:
+        return pd.read_parquet(dataPath), manifest
+    except Exception:
+        print("WARNING: Corrupted message store " + dataPath)
+        return None, getEmptyManifest(user)
+
+
+def saveStore(data: pd.DataFrame, manifest: dict, cache_dir: str):
+    if not isinstance(cache_dir, str):
+        return
+
+    assertDir(cache_dir)
+    dataPath = os.path.join(cache_dir, STORE_DATA_FILE)
+    manifestPath = os.path.join(cache_dir, STORE_MANIFEST_FILE)
+
+    data.to_parquet(dataPath + ".tmp", index=False)
+    os.replace(dataPath + ".tmp", dataPath)
+
+    with open(manifestPath + ".tmp", "w", encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def getFileKey(fileDir: str) -> str:
+    return "/".join([os.path.basename(os.path.dirname(fileDir)),
+                     os.path.basename(fileDir)])
+
+
+def getSignature(info: zipfile.ZipInfo) -> list:
+    # crc and size come from the zip directory, nothing is decompressed
+    return [info.CRC, info.file_size]
+
+
+def getChangedFiles(files: list, manifest: dict) -> list:
+    return [(zipPath, info) for zipPath, info in files
+            if manifest["files"].get(getFileKey(info.filename)) != getSignature(info)]
+
+
+def recordFiles(files: list, manifest: dict):
+    for _, info in files:
+        manifest["files"][getFileKey(info.filename)] = getSignature(info)
+
+
+def getLatestTimestamps(data: pd.DataFrame) -> dict:
+    if data is None or len(data) == 0:
+        return dict()
+
+    latest = data.groupby("thread", observed=True)["timestamp_ms"].max()
+
+    return {str(thread): int(timestamp) for thread, timestamp in latest.items()}
+
+
+def mergeMessages(stored: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    if stored is None:
+        merged = new.reset_index(drop=True)
+    else:
+        merged = concatMessages([stored, new])
+
+    keys = pd.DataFrame({
+        "thread": merged["thread"].values,
+        "timestamp_ms": merged["timestamp_ms"].values,
+        "sender_name": merged["sender_name"].values,
+        "content_hash": pd.util.hash_pandas_object(
+            merged["content"], index=False).values})
+
+    return merged[~keys.duplicated().values].reset_index(drop=True)
@@ -1,73 +1,211 @@
-import spacy
-from spacy.lang.xx import MultiLanguage
 import numpy as np
 import pandas as pd
 import math
+from collections import deque
+from typing import TYPE_CHECKING
 
 from .parameters import getParam
+from .nlp_cache import getNLPKey, loadNLPEntry, saveNLPEntry
+
+# spaCy is imported only where a model is used, annotations do not load it
+if TYPE_CHECKING:
+    import spacy
 
 LANGUAGE = getParam('language')
 LANGUAGE_MODELS = getParam('languageModels')
 
+# components producing lemmas, part of speech tags and entities, in spaCy 2 and 3
+DIVERSITY_PIPES = ["tok2vec", "tagger", "morphologizer",
+                   "attribute_ruler", "lemmatizer", "ner"]
+
 
-def getModel(language: str, language_models: dict = LANGUAGE_MODELS) -> spacy.lang:
+def getModel(language: str, language_models: dict = LANGUAGE_MODELS) -> "spacy.language.Language":
+    import spacy
+    from spacy.lang.xx import MultiLanguage
 
     if language not in language_models.keys():
         print("language not supported. Running on MultiLanguage.")
         return MultiLanguage()
 
-    return spacy.load(language_models[language], disable=["parser"])
+    model = spacy.load(language_models[language])
+
+    # calculateDiversity needs only lemmas, part of speech tags and entities
+    for pipeName in list(model.pipe_names):
+        if pipeName not in DIVERSITY_PIPES:
+            model.remove_pipe(pipeName)
+
+    return model
+
+
+def getLookupLemmas(doc: "spacy.tokens.Doc", orths: np.ndarray) -> np.ndarray:
+    # the same fallback as Token.lemma_, looked up once per distinct word
+    lemmatizer = getattr(doc.vocab.morphology, "lemmatizer", None)
+    if lemmatizer == None:
+        return orths
 
+    uniqueOrths, inverse = np.unique(orths, return_inverse=True)
+    lemmas = [doc.vocab.strings.add(lemmatizer.lookup(doc.vocab.strings[orth], orth=orth))
+              for orth in uniqueOrths.tolist()]
 
-def removeEntities(doc: spacy.tokens.Doc) -> list:
-    entityRanges = np.concatenate(
-        [np.arange(e.start, e.end) for e in doc.ents])
+    return np.array(lemmas, dtype=np.uint64).reshape(-1)[inverse]
 
-    return [token for token in doc if token.i not in entityRanges]
 
+def getLemmaIds(doc: "spacy.tokens.Doc") -> np.ndarray:
+    from spacy.attrs import LEMMA, ORTH, POS, ENT_IOB
+    from spacy.symbols import PUNCT, NUM
 
-def removePunctuation(doc: list) -> list:
-    return [token for token in doc if token.pos_ != "PUNCT"]
+    attributes = doc.to_array([LEMMA, ORTH, POS, ENT_IOB])
 
+    # tokens inside entities are tagged I (1) or B (3)
+    noEnts = (attributes[:, 3] != 1) & (attributes[:, 3] != 3)
+    noPunct = attributes[:, 2] != PUNCT
+    noNum = attributes[:, 2] != NUM
 
-def removeNumbers(doc: list) -> list:
-    return [token for token in doc if token.pos_ != "NUM"]
+    # LEMMA is 0 for tokens no pipeline component lemmatized
+    lemmas = attributes[:, 0].copy()
+    missing = lemmas == 0
+    if missing.any():
+        lemmas[missing] = getLookupLemmas(doc, attributes[missing, 1])
 
+    return lemmas[noEnts & noPunct & noNum]
 
-def calculateDiversity(doc: spacy.tokens.Doc, batch_size: int = 2000) -> float:
-    noEnts = removeEntities(doc)
-    noPunct = removePunctuation(noEnts)
-    noNum = removeNumbers(noPunct)
-    prep = np.array(noNum)
+
+def countUniqueInRows(batches: np.ndarray) -> np.ndarray:
+    sortedBatches = np.sort(batches, axis=1)
+
+    return 1 + np.count_nonzero(np.diff(sortedBatches, axis=1), axis=1)
+
+
+def calculateDiversity(doc: "spacy.tokens.Doc", batch_size: int = 2000) -> float:
+    prep = getLemmaIds(doc)
 
     if batch_size > len(prep):
         return None
 
-    excess = len(prep) % batch_size
+    batchesNumber = len(prep) // batch_size
+    batches = np.reshape(prep[:batchesNumber * batch_size], (-1, batch_size))
 
-    if(excess == 0):
-        batches = np.reshape(prep, (-1, batch_size))
-    else:
-        batches = np.reshape(prep[:-excess], (-1, batch_size))
+    lemmaNumbers = countUniqueInRows(batches)
 
-    lemmaNumbers = list()
-    for batch in batches:
-        lemmas = set()
-        for token in batch:
-            lemmas.add(token.lemma_)
-        lemmaNumbers.append(len(lemmas))
+    return float(lemmaNumbers.mean())/batch_size
 
-    return sum(lemmaNumbers)/len(lemmaNumbers)/batch_size
 
+class MovingDiversity():
+    """Moving-average type-token ratio of a lemma stream, fed one doc at a time"""
 
-def getChatStrings(df: pd.DataFrame, chat: str, avg_batch_chars: int = 70000) -> dict:
+    def __init__(self, window_size: int):
+        self.windowSize = window_size
+        self.window = deque()
+        self.lemmaCounts = dict()
+        self.typesSum = 0
+        self.windowsNumber = 0
+
+    def update(self, lemmaIds: np.ndarray):
+        window = self.window
+        lemmaCounts = self.lemmaCounts
+
+        for lemma in lemmaIds.tolist():
+            window.append(lemma)
+            lemmaCounts[lemma] = lemmaCounts.get(lemma, 0) + 1
+
+            if len(window) > self.windowSize:
+                oldLemma = window.popleft()
+                if lemmaCounts[oldLemma] == 1:
+                    del lemmaCounts[oldLemma]
+                else:
+                    lemmaCounts[oldLemma] = lemmaCounts[oldLemma] - 1
+
+            # every full window adds its number of distinct lemmas
+            if len(window) == self.windowSize:
+                self.typesSum = self.typesSum + len(lemmaCounts)
+                self.windowsNumber = self.windowsNumber + 1
+
+    def score(self) -> float:
+        if self.windowsNumber == 0:
+            return None
+
+        return self.typesSum/self.windowsNumber/self.windowSize
+
+
+def getDiversityKey(language: str, text, batch_size: int, kind: str = "diversity", language_models: dict = LANGUAGE_MODELS) -> str:
+    import spacy
+
+    return getNLPKey(kind, spacy.__version__, language_models.get(language),
+                     DIVERSITY_PIPES, batch_size, text)
+
+
+def getDiversityScores(language: str, chatStrings: dict, batch_size: int = 2000, pipe_batch_size: int = 4, workers: int = 1, cache_dir: str = None) -> dict:
+    textKeys = {text: getDiversityKey(language, text, batch_size)
+                for batches in chatStrings.values() for text in batches}
+
+    textScores = dict()
+    for text, key in textKeys.items():
+        found, score = loadNLPEntry(key, cache_dir)
+        if found:
+            textScores[text] = score
+
+    # the model is loaded only if some batch is not cached
+    missing = [text for text in textKeys.keys() if text not in textScores]
+    if len(missing) > 0:
+        model = getModel(language=language)
+
+        docs = model.pipe(missing, batch_size=pipe_batch_size, n_process=workers)
+        for text, doc in zip(missing, docs):
+            textScores[text] = calculateDiversity(doc, batch_size=batch_size)
+            saveNLPEntry(textKeys[text], textScores[text], cache_dir)
+
+    scores = dict()
+    for key, batches in chatStrings.items():
+        batchScores = [textScores[text] for text in batches]
+        scores[key] = [score for score in batchScores if score != None]
+
+    return scores
+
+
+def getMovingDiversityScores(language: str, chatMessages: dict, window_size: int = 2000, pipe_batch_size: int = 256, workers: int = 1, cache_dir: str = None) -> dict:
+    cacheKeys = {key: getDiversityKey(language, messages, window_size, kind="movingDiversity")
+                 for key, messages in chatMessages.items()}
+
+    chatScores = dict()
+    for key, cacheKey in cacheKeys.items():
+        found, score = loadNLPEntry(cacheKey, cache_dir)
+        if found:
+            chatScores[key] = score
+
+    # messages of one chat are contiguous in the stream, only their window is kept
+    missing = [key for key in cacheKeys.keys() if key not in chatScores]
+    if len(missing) > 0:
+        model = getModel(language=language)
+        engines = {key: MovingDiversity(window_size) for key in missing}
+
+        messages = ((message, key)
+                    for key in missing for message in chatMessages[key])
+        for doc, key in model.pipe(messages, as_tuples=True, batch_size=pipe_batch_size, n_process=workers):
+            engines[key].update(getLemmaIds(doc))
+
+        for key, engine in engines.items():
+            chatScores[key] = engine.score()
+            saveNLPEntry(cacheKeys[key], chatScores[key], cache_dir)
+
+    return {key: [] if score == None else [score] for key, score in chatScores.items()}
+
+
+def getChatMessages(df: pd.DataFrame, chat: str) -> dict:
     prep = df.dropna(subset=["content"])
     oneChat = prep[prep["chat_with"] == chat]
 
-    chatStrings = dict()
+    chatMessages = dict()
     for direction in ["Sent", "Received"]:
         directedChat = oneChat[oneChat["message_direction"] == direction]
-        messages = np.array(directedChat["content"].astype(str).values)
+        chatMessages[direction] = list(directedChat["content"].astype(str).values)
+
+    return chatMessages
+
+
+def getChatStrings(df: pd.DataFrame, chat: str, avg_batch_chars: int = 70000) -> dict:
+    chatStrings = dict()
+    for direction, directedMessages in getChatMessages(df, chat).items():
+        messages = np.array(directedMessages, dtype=object)
 
         totalLen = sum([len(message) for message in messages])
         batchNum = math.ceil(totalLen/avg_batch_chars)
@@ -1,49 +1,70 @@
 from collections import OrderedDict
+from array import array
 import numpy as np
 import os
 import re
 import pandas as pd
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, coo_matrix
 
 from .parameters import getParam
+from .nlp_cache import getNLPKey
 
 DEFAULT_STOPWORDS_FOLDER = getParam('stopwordsDirectory')
 
+# words starting with http, as split by str.split
+LINK_PATTERN = re.compile(r'(?<!\S)http\S*')
 
-def getStopwords(language: str, stopwords_dir: str = DEFAULT_STOPWORDS_FOLDER) -> list:
+
+def getStopwords(language: str, stopwords_dir: str = DEFAULT_STOPWORDS_FOLDER) -> frozenset:
     for root, _, files in os.walk(stopwords_dir):
         for file in files:
             if (file.endswith("stopwords.txt") and file.startswith(language)):
                 with open(os.path.join(root, file), "r") as f:
-                    return [x.strip() for x in f.readlines()]
+                    return frozenset(x.strip() for x in f.readlines())
 
-    return []
+    return frozenset()
 
 
 class NGramExtractor():
-    def __init__(self, language: str, IDFCorpus: list = None, max_n: int = 4, stopwords_dir: str = DEFAULT_STOPWORDS_FOLDER, following_character_limit: int = 2):
+    def __init__(self, language: str, IDFCorpus: list = None, max_n: int = 4, stopwords_dir: str = DEFAULT_STOPWORDS_FOLDER, following_character_limit: int = 2, batched: bool = True):
         self.d = 0.85  # damping coefficient, usually is .85
-        self.steps = 400  # iteration steps
+        self.steps = 400  # max iteration steps
+        self.tolerance = 1e-6  # stop once no weight changes more than that
+        self.batched = batched  # rank all chunks of a text at once
         self.batchTokens = 1400  # tokens in one extraction batch
         self.max_n = max_n  # max n_gram
         self.language = language
         self.stopwords = getStopwords(
             language=language, stopwords_dir=stopwords_dir)
 
+        # words are interned, n-grams are tuples of word ids
+        self.wordIds = dict()
+        self.words = list()
+        self.isStopword = bytearray()
+
         self.followingCharacterLimit = following_character_limit
+        if(following_character_limit != None):
+            # the first character of a run is always kept
+            limit = max(following_character_limit, 1)
+            self.repetitionPattern = re.compile(
+                r'(.)\1{%d,}' % limit, flags=re.DOTALL)
+            self.repetitionReplacement = r'\g<1>' * limit
         self.node_weight = None
         self.idfCorpus = None
         if(IDFCorpus != None):
             self.initIDFCorpus(IDFCorpus)
 
     def initIDFCorpus(self, corpus: list):
+        self.initIDFTokens([self.get_word_sentences(doc) for doc in corpus])
+
+    def initIDFTokens(self, tokenizedCorpus: list):
         idfs = list()
 
         for n_gram in range(1, self.max_n + 1):
             nGramOccurences = dict()
 
-            for doc in corpus:
-                sentences = self.get_sentence_tokens(text=doc, n_gram=n_gram)
+            for wordSentences in tokenizedCorpus:
+                sentences = self.get_n_gram_sentences(wordSentences, n_gram)
                 tokensInDoc = set()
 
                 for sentence in sentences:
@@ -56,7 +77,7 @@ class NGramExtractor():
                     else:
                         nGramOccurences[token] = 1
 
-            numberOfDocs = len(corpus)
+            numberOfDocs = len(tokenizedCorpus)
 
             nGramIDF = {k: np.log(numberOfDocs/float(v))
                         for k, v in nGramOccurences.items()}
@@ -65,52 +86,46 @@ class NGramExtractor():
         self.idfCorpus = idfs
 
     def clean_text(self, text: str):
-        noLinks = " ".join([word.lower() for word in text.split()
-                            if not word.startswith("http")])
+        noLinks = " ".join(LINK_PATTERN.sub("", text).split()).lower()
         if(self.followingCharacterLimit == None):
             return noLinks
 
-        noRepetitions = []
-        chars = [char for char in noLinks]
+        return self.repetitionPattern.sub(self.repetitionReplacement, noLinks)
 
-        counter = 0
-        currchar = '\n'
+    def intern(self, word: str) -> int:
+        wordId = self.wordIds.get(word)
 
-        for char in chars:
-            if char != currchar:
-                currchar = char
-                counter = 1
-                noRepetitions.append(char)
-                continue
-            if (counter < self.followingCharacterLimit):
-                counter = counter+1
-                noRepetitions.append(char)
+        if wordId == None:
+            wordId = len(self.words)
+            self.wordIds[word] = wordId
+            self.words.append(word)
+            self.isStopword.append(word in self.stopwords)
 
-        return "".join(noRepetitions)
+        return wordId
 
-    def get_n_grams(self, sentence: list, grams: int):
-        tokens = []
-        for i in range(len(sentence)-grams):
-            tokenSequence = sentence[i:i+grams]
-            if (tokenSequence[0] in self.stopwords or tokenSequence[-1] in self.stopwords):
-                continue
+    def get_n_gram_text(self, nGram: tuple) -> str:
+        return " ".join([self.words[wordId] for wordId in nGram])
+
+    def get_n_grams(self, sentence: array, grams: int):
+        isStopword = self.isStopword
 
-            token = " ".join(tokenSequence)
-            tokens.append(token)
-        return tokens
+        return [tuple(sentence[i:i+grams]) for i in range(len(sentence)-grams)
+                if not (isStopword[sentence[i]] or isStopword[sentence[i+grams-1]])]
 
-    def get_sentence_tokens(self, text: str, n_gram: int):
+    def get_word_sentences(self, text: str):
         cleanText = self.clean_text(text)
+        intern = self.intern
 
-        processedSentences = []
+        wordSentences = []
         for sentence in cleanText.split('.'):
-            words = [word for word in sentence.split(
-            ) if word.isalpha()]
+            words = array('i', [intern(word) for word in sentence.split(
+            ) if word.isalpha()])
+            wordSentences.append(words)
 
-            tokens = self.get_n_grams(words, n_gram)
-            processedSentences.append(tokens)
+        return wordSentences
 
-        return processedSentences
+    def get_n_gram_sentences(self, wordSentences: list, n_gram: int):
+        return [self.get_n_grams(words, n_gram) for words in wordSentences]
 
     def chunkize(self, sentences):
         chunks = []
@@ -150,24 +165,30 @@ class NGramExtractor():
                         token_pairs.add(pair)
         return token_pairs
 
-    def get_matrix(self, vocab, token_pairs):
-        vocab_size = len(vocab)
-        g = np.zeros((vocab_size, vocab_size), dtype='float')
-        for word1, word2 in token_pairs:
-            i, j = vocab[word1], vocab[word2]
-            if i == j:
-                continue
-            g[j][i] = g[j][i] + 1
-            g[i][j] = g[i][j] + 1
+    def get_edges(self, vocab, token_pairs):
+        pairs = np.array([(vocab[word1], vocab[word2]) for word1, word2 in token_pairs],
+                         dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+
+        # every pair is an undirected edge, duplicates are summed by coo -> csr
+        rows = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        cols = np.concatenate([pairs[:, 0], pairs[:, 1]])
 
-        g_sparse = csr_matrix(g)
+        return rows, cols
 
-        norm = np.sum(g, axis=0)
+    def get_normalized_matrix(self, rows, cols, size: int):
+        g = coo_matrix((np.ones(len(rows)), (rows, cols)),
+                       shape=(size, size)).tocsr()
+
+        norm = np.asarray(g.sum(axis=0)).ravel()
         norm[norm == 0] = 1
 
-        g_sp_norm = g_sparse._divide(norm)
+        return csr_matrix(g.multiply(1 / norm.reshape(1, -1)))
+
+    def get_matrix(self, vocab, token_pairs):
+        rows, cols = self.get_edges(vocab, token_pairs)
 
-        return csr_matrix(g_sp_norm)
+        return self.get_normalized_matrix(rows, cols, len(vocab))
 
     def get_keywords_with_values(self, node_weights, part=0.7):
         node_weight = OrderedDict(
@@ -182,7 +203,7 @@ class NGramExtractor():
                 break
         return keywords
 
-    def get_keywords_for_chunk(self, sentences, window_size=2):
+    def get_chunk_graph(self, sentences, window_size=2):
         # Build vocabulary
         vocab = self.get_vocab(sentences)
 
@@ -192,42 +213,115 @@ class NGramExtractor():
         # Get normalized matrix
         g = self.get_matrix(vocab, token_pairs)
 
+        return vocab, g
+
+    def rank(self, g, size: int):
         # Initionlization for weight(pagerank value)
-        pr = np.array([1] * len(vocab))
+        pr = np.ones(size)
 
         # Iteration
         for _ in range(self.steps):
-            pr = (1-self.d) + self.d * g.dot(pr)
+            newPr = (1-self.d) + self.d * g.dot(pr)
+            converged = np.abs(newPr - pr).max(initial=0) < self.tolerance
+            pr = newPr
+
+            if converged:
+                break
+
+        return pr
 
+    def get_chunk_keywords(self, vocab, pr):
         # Get weight for each node
         node_weight = dict()
         for word, index in vocab.items():
             node_weight[word] = pr[index]
 
-        keywords = self.get_keywords_with_values(node_weight, part=0.7)
+        return self.get_keywords_with_values(node_weight, part=0.7)
+
+    def get_keywords_for_chunk(self, sentences, window_size=2):
+        vocab, g = self.get_chunk_graph(sentences, window_size)
+
+        pr = self.rank(g, len(vocab))
+
+        return self.get_chunk_keywords(vocab, pr)
+
+    def get_keywords_for_chunks(self, chunks, window_size=2):
+        vocabs = list()
+        allRows = list()
+        allCols = list()
+        offset = 0
+
+        # chunks are disconnected blocks of one graph, their indices are shifted
+        for chunk in chunks:
+            vocab = self.get_vocab(chunk)
+            if len(vocab) == 0:
+                continue
+
+            rows, cols = self.get_edges(
+                vocab, self.get_token_pairs(window_size, chunk))
+            vocabs.append(vocab)
+            allRows.append(rows + offset)
+            allCols.append(cols + offset)
+            offset = offset + len(vocab)
+
+        if len(vocabs) == 0:
+            return []
+
+        # columns never cross blocks, so normalizing the whole graph is per chunk
+        g = self.get_normalized_matrix(
+            np.concatenate(allRows), np.concatenate(allCols), offset)
+        pr = self.rank(g, offset)
+
+        keywords = []
+        offset = 0
+        for vocab in vocabs:
+            keywords.append(self.get_chunk_keywords(
+                vocab, pr[offset:offset + len(vocab)]))
+            offset = offset + len(vocab)
+
         return keywords
 
     def analyze(self, text,
                 window_size=2, n_gram: int = 2, keywords_number: int = 10):
         """Main function to analyze text"""
 
-        # Parse text
-        allSentences = self.get_sentence_tokens(text, n_gram)
+        return self.analyzeTokens(self.get_word_sentences(text), window_size=window_size,
+                                  n_gram=n_gram, keywords_number=keywords_number)
+
+    def analyzeTokens(self, wordSentences: list,
+                      window_size=2, n_gram: int = 2, keywords_number: int = 10):
+        """Analyze text already split by get_word_sentences"""
+
+        keywordValue = self.rankTokens(
+            wordSentences, window_size=window_size, n_gram=n_gram)
+
+        return self.selectKeywords(keywordValue, n_gram=n_gram, keywords_number=keywords_number)
+
+    def rankTokens(self, wordSentences: list, window_size=2, n_gram: int = 2) -> dict:
+        """TextRank values of all n-grams, before the IDF weighting"""
+
+        allSentences = self.get_n_gram_sentences(wordSentences, n_gram)
 
         chunks = self.chunkize(allSentences)
 
-        keywordValue = dict()
+        if self.batched:
+            chunksKeywords = self.get_keywords_for_chunks(chunks, window_size)
+        else:
+            chunksKeywords = [self.get_keywords_for_chunk(
+                chunk, window_size) for chunk in chunks]
 
-        for chunk in chunks:
-            chunkKeywords = self.get_keywords_for_chunk(
-                chunk, window_size)
+        keywordValue = dict()
 
+        for chunkKeywords in chunksKeywords:
             for kwd in chunkKeywords:
                 if kwd[0] in keywordValue.keys():
                     keywordValue[kwd[0]] = keywordValue[kwd[0]] + kwd[1]
                 else:
                     keywordValue[kwd[0]] = kwd[1]
 
+        return keywordValue
+
+    def selectKeywords(self, keywordValue: dict, n_gram: int = 2, keywords_number: int = 10) -> list:
         if self.idfCorpus != None:
             finalKwdValue = {
                 k: v*self.idfCorpus[n_gram-1][k] for k, v in keywordValue.items()}
@@ -238,4 +332,18 @@ class NGramExtractor():
         keywordsList = sorted(finalKwdValue.items(),
                               key=lambda item: item[1], reverse=True)
 
-        return keywordsList[:keywords_number]
+        return [(self.get_n_gram_text(nGram), value)
+                for nGram, value in keywordsList[:keywords_number]]
+
+    def get_text_values(self, keywordValue: dict) -> list:
+        return [[self.get_n_gram_text(nGram), value] for nGram, value in keywordValue.items()]
+
+    def get_id_values(self, textValues: list) -> dict:
+        return {tuple(self.intern(word) for word in text.split(" ")): value
+                for text, value in textValues}
+
+    def get_cache_key(self, text: str, n_gram: int, window_size: int) -> str:
+        settings = [self.language, sorted(self.stopwords), self.d, self.steps, self.tolerance,
+                    self.batched, self.batchTokens, self.followingCharacterLimit]
+
+        return getNLPKey("keywords", settings, n_gram, window_size, text)
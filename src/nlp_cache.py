@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+
+from .parameters import getParam
+from .utils import assertDir
+
+CACHE_DIR = getParam('cacheDirectory')
+NLP_CACHE_MAX_BYTES = getParam('nlpCache')['maxMegabytes'] * 2**20
+NLP_CACHE_VERSION = 2
+NLP_CACHE_SUBDIR = "nlp"
+
+
+def getNLPKey(*parts) -> str:
+    serialized = json.dumps([NLP_CACHE_VERSION, parts],
+                            sort_keys=True, ensure_ascii=False)
+
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def getEntryPath(key: str, cache_dir: str = CACHE_DIR) -> str:
+    return os.path.join(cache_dir, NLP_CACHE_SUBDIR, key + ".json")
+
+
+def loadNLPEntry(key: str, cache_dir: str = CACHE_DIR):
+    if not isinstance(cache_dir, str):
+        return False, None
+
+    path = getEntryPath(key, cache_dir)
+
+    try:
+        with open(path, "r", encoding='utf-8') as file:
+            value = json.load(file)
+    except FileNotFoundError:
+        return False, None
+    except Exception:
+        print("WARNING: Corrupted NLP cache entry " + path)
+        return False, None
+
+    # the modification time orders entries by their last use
+    os.utime(path)
+
+    return True, value
+
+
+def saveNLPEntry(key: str, value, cache_dir: str = CACHE_DIR):
+    if not isinstance(cache_dir, str):
+        return
+
+    path = getEntryPath(key, cache_dir)
+    assertDir(os.path.dirname(path))
+
+    with open(path + ".tmp", "w", encoding='utf-8') as file:
+        json.dump(value, file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(path + ".tmp", path)
+
+
+def pruneNLPCache(cache_dir: str = CACHE_DIR, max_bytes: int = NLP_CACHE_MAX_BYTES):
+    if not isinstance(cache_dir, str):
+        return
+
+    entriesDir = os.path.join(cache_dir, NLP_CACHE_SUBDIR)
+    if not os.path.exists(entriesDir):
+        return
+
+    entries = list()
+    for fileName in os.listdir(entriesDir):
+        if fileName.endswith(".json"):
+            stat = os.stat(os.path.join(entriesDir, fileName))
+            entries.append((stat.st_mtime, stat.st_size, fileName))
+
+    # the least recently used entries go first
+    totalBytes = sum(size for _, size, _ in entries)
+    for _, size, fileName in sorted(entries):
+        if totalBytes <= max_bytes:
+            break
+
+        os.remove(os.path.join(entriesDir, fileName))
+        totalBytes = totalBytes - size
@@ -1,8 +1,10 @@
 import json
+from functools import lru_cache
 
 PARAM_FILE = 'params.json'
 
 
+@lru_cache(maxsize=None)
 def getParams(paramFile: str = PARAM_FILE) -> dict:
     with open(paramFile, "r", encoding='utf-8') as file:
         params = json.load(file)
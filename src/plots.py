@@ -1,41 +1,73 @@
 import pandas as pd
 import seaborn as sns
-import statsmodels
-import datetime
 import os
-import random
 import re
+import zlib
 import numpy as np
-import time
 import math
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator
-from datetime import date
-from wordcloud import WordCloud
 
 from .parameters import getParam
-from .utils import assertDir, countWords
+from .utils import assertDir, datesToTimestamps, getWorkersNumber, initAggWorker
+from .trends import getTrends
+from .aggregates import getChatRanking, getDaysNumber, getDirectionNames
 
 from .n_gram_extractor import NGramExtractor
-from .language_diversity import getChatStrings, calculateDiversity, getModel
+from .language_diversity import getChatStrings, getChatMessages, getDiversityScores, getMovingDiversityScores
+from .figure_manifest import getFrameHash, getFigureHash, getFigureKey, loadManifest, recordFigures, isFigureCurrent
+from .nlp_cache import loadNLPEntry, saveNLPEntry, pruneNLPCache
 
 FONT_PATH = getParam('wordClouds')['fontsPath']
 FONT_NAME = getParam('wordClouds')['fontFile']
 COLORS = getParam('wordClouds')['colors']
 
+# extractor fitted in the main process, set in keyword cloud workers
+CLOUD_EXTRACTOR = None
+
 sns.set()
 
 
-def plotMessagesInChats(data: pd.DataFrame, chats: int, user: str, save_dir: str = None):
+def getChatCounts(data: pd.DataFrame) -> pd.Series:
+    chatCounts = data["chat_with"].value_counts()
+
+    return chatCounts[chatCounts > 0]
+
+
+def drawTrends(trends: pd.DataFrame, legend_title: str, palette: str = None, legend_out: bool = False, height: float = 5, aspect: float = 1.7):
+    fig, ax = plt.subplots(figsize=(height * aspect, height))
+    colors = sns.color_palette(palette, len(trends["group"].cat.categories))
+    lineWidth = plt.rcParams["lines.linewidth"] * 1.5
+
+    for color, group in zip(colors, trends["group"].cat.categories):
+        trend = trends[trends["group"] == group]
+        if len(trend) == 0:
+            continue
+
+        ax.plot(trend["x"], trend["y"], color=color,
+                linewidth=lineWidth, label=group)
+        ax.fill_between(trend["x"], trend["low"], trend["high"],
+                        color=color, alpha=0.15, linewidth=0)
+
+    if legend_out:
+        ax.legend(title=legend_title, loc="center left",
+                  bbox_to_anchor=(1, 0.5), frameon=False)
+    else:
+        ax.legend(title=legend_title)
+
+    return fig, ax
+
+
+def plotMessagesInChats(cube: pd.DataFrame, chats: int, user: str, save_dir: str = None):
     plotName = "messages-in-chats"
 
-    noGroup = data[data["chat_with"] != "GROUP"]
-    plotDataSeries = noGroup["chat_with"].value_counts()[:chats]
+    noGroup = cube[cube["chat_with"] != "GROUP"]
+    plotDataSeries = getChatRanking(noGroup)[:chats]
 
-    plotData = pd.DataFrame(plotDataSeries)
-    plotData["person"] = plotData.index
-    plotData["messages_number"] = plotData["chat_with"]
+    plotData = pd.DataFrame({"person": plotDataSeries.index.astype(str),
+                             "messages_number": plotDataSeries.values})
     ax = sns.barplot(x=plotData["messages_number"],
                      y=plotData["person"], orient="h")
     ax.grid(True)
@@ -51,48 +83,38 @@ def plotMessagesInChats(data: pd.DataFrame, chats: int, user: str, save_dir: str
         ax.figure.savefig(fullPath, bbox_inches='tight')
 
 
-def plotActivityOverTime(data: pd.DataFrame, user: str, save_dir: str = None, order: int = 5):
+def plotActivityOverTime(cube: pd.DataFrame, user: str, save_dir: str = None, order: int = 5):
     plotName = "activity-over-time"
 
-    noGroup = data[data["chat_with"] != "GROUP"]
-
-    noGroup["sent_by_user"] = noGroup["sender_name"].apply(
-        lambda x: True if x == user else False)
-
-    byDates = noGroup.groupby(
-        ["date", "sent_by_user"], as_index=True).agg('count')
+    noGroup = cube[cube["chat_with"] != "GROUP"]
 
-    plotting = byDates.reset_index()
+    plotting = noGroup.groupby(["date", "sent_by_user"], observed=True)[
+        "messages"].sum().reset_index(name="messages_per_day")
 
-    plotting["messages_per_day"] = plotting["sender_name"]
+    plotting["date_float"] = datesToTimestamps(plotting["date"])
 
-    plotting["datetime"] = plotting["date"].astype(str).apply(
-        lambda dstr: time.mktime(time.strptime(dstr, r"%Y-%m-%d")))
+    plotting["Message direction"] = getDirectionNames(
+        plotting["sent_by_user"])
 
-    plotting["date_float"] = plotting["datetime"].values.astype(float)
+    trends = getTrends(plotting, x="date_float", y="messages_per_day",
+                       hue="Message direction", order=order, ci=95)
+    fig, ax = drawTrends(trends, legend_title="Message direction", palette="Set1")
 
-    plotting["Message direction"] = plotting["sent_by_user"].apply(
-        lambda x: "Sent" if x else "Received")
-
-    g = sns.lmplot(data=plotting, x="date_float", y="messages_per_day",
-                   hue="Message direction", scatter=False, order=order, legend_out=False, aspect=1.7, palette="Set1")
-
-    g.set(xlim=(plotting["date_float"].min(), plotting["date_float"].max()))
-    g.set(ylim=(0, None))
+    ax.set_xlim(plotting["date_float"].min(), plotting["date_float"].max())
+    ax.set_ylim(0, None)
 
     plt.subplots_adjust(top=0.9)
-    g.fig.suptitle("Average messages number over time")
+    fig.suptitle("Average messages number over time")
 
-    g.axes[0, 0].yaxis.set_major_locator(plt.MaxNLocator(10))
-    g.axes[0, 0].xaxis.set_major_locator(plt.MaxNLocator(10))
+    ax.yaxis.set_major_locator(plt.MaxNLocator(10))
+    ax.xaxis.set_major_locator(plt.MaxNLocator(10))
 
-    g.axes[0, 0].set_xlabel('Time')
-    g.axes[0, 0].set_ylabel('Messages per day')
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Messages per day')
 
-    xticks = g.axes[0, 0].get_xticks()
-    xticks_dates = [datetime.datetime.fromtimestamp(
-        x).strftime(' %b %Y') for x in xticks]
-    g.axes[0, 0].set_xticklabels(
+    xticks = ax.get_xticks()
+    xticks_dates = pd.to_datetime(xticks, unit='s').strftime(' %b %Y')
+    ax.set_xticklabels(
         xticks_dates,  rotation=45, horizontalalignment='right')
 
     if save_dir == None:
@@ -100,58 +122,50 @@ def plotActivityOverTime(data: pd.DataFrame, user: str, save_dir: str = None, or
     else:
         assertDir(save_dir)
         fullPath = os.path.join(save_dir, plotName+".png")
-        g.savefig(fullPath)
+        fig.savefig(fullPath, bbox_inches='tight')
 
 
-def plotActivityForMostFrequentNonGroupChats(data: pd.DataFrame, chats: int, order: int, save_dir: str = None):
+def plotActivityForMostFrequentNonGroupChats(cube: pd.DataFrame, chats: int, order: int, save_dir: str = None):
     plotName = "activity-for-most-frequent-non-group-chats"
 
     legendOut = True if chats > 5 else False
 
-    noGroup = data[data["chat_with"] != "GROUP"]
-    plotDataSeries = noGroup["chat_with"].value_counts()[:chats]
+    noGroup = cube[cube["chat_with"] != "GROUP"]
+    plotDataSeries = getChatRanking(noGroup)[:chats]
 
     names = [name[0] for name in plotDataSeries.items()]
 
     onlyChosen = noGroup[noGroup["chat_with"].isin(names)]
 
-    byDates = onlyChosen.groupby(["date", "chat_with"], as_index=True).agg(
-        'count')
-
-    plotting = byDates.reset_index()
-
-    plotting["messages_per_day"] = plotting["sender_name"]
-
-    plotting["datetime"] = plotting["date"].astype(str).apply(
-        lambda dstr: time.mktime(time.strptime(dstr, "%Y-%m-%d")))
+    plotting = onlyChosen.groupby(["date", "chat_with"], observed=True)[
+        "messages"].sum().reset_index(name="messages_per_day")
 
-    plotting["date_float"] = plotting["datetime"].values.astype(float)
+    plotting["date_float"] = datesToTimestamps(plotting["date"])
 
     cat_type = pd.api.types.CategoricalDtype(categories=names, ordered=True)
 
     plotting['chat_with'] = plotting['chat_with'].astype(cat_type)
 
-    g = sns.lmplot(data=plotting, x="date_float", y="messages_per_day", hue="chat_with",
-                   scatter=False, order=order, legend_out=legendOut, aspect=1.7, ci=None)
+    trends = getTrends(plotting, x="date_float", y="messages_per_day",
+                       hue="chat_with", order=order, ci=None)
+    fig, ax = drawTrends(trends, legend_title="Chat", legend_out=legendOut)
 
-    g.set(xlim=(plotting["date_float"].min(),
-                plotting["date_float"].max()), ylim=(0, None))
+    ax.set_xlim(plotting["date_float"].min(), plotting["date_float"].max())
+    ax.set_ylim(0, None)
 
     plt.subplots_adjust(top=0.9)
-    g.fig.suptitle("Average messages number in most frequent chats")
+    fig.suptitle("Average messages number in most frequent chats")
 
-    g.axes[0, 0].yaxis.set_major_locator(plt.MaxNLocator(10))
-    g.axes[0, 0].yaxis.set_minor_locator(plt.MaxNLocator(20))
-    g.axes[0, 0].xaxis.set_major_locator(plt.MaxNLocator(10))
+    ax.yaxis.set_major_locator(plt.MaxNLocator(10))
+    ax.yaxis.set_minor_locator(plt.MaxNLocator(20))
+    ax.xaxis.set_major_locator(plt.MaxNLocator(10))
 
-    g.axes[0, 0].set_xlabel('Time')
-    g.axes[0, 0].set_ylabel('Messages per day')
-    g._legend.set_title("Chat")
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Messages per day')
 
-    xticks = g.axes[0, 0].get_xticks()
-    xticks_dates = [datetime.datetime.fromtimestamp(
-        x).strftime(' %b %Y') for x in xticks]
-    g.axes[0, 0].set_xticklabels(
+    xticks = ax.get_xticks()
+    xticks_dates = pd.to_datetime(xticks, unit='s').strftime(' %b %Y')
+    ax.set_xticklabels(
         xticks_dates,  rotation=45, horizontalalignment='right')
 
     if save_dir == None:
@@ -159,33 +173,24 @@ def plotActivityForMostFrequentNonGroupChats(data: pd.DataFrame, chats: int, ord
     else:
         assertDir(save_dir)
         fullPath = os.path.join(save_dir, plotName+".png")
-        g.savefig(fullPath)
+        fig.savefig(fullPath, bbox_inches='tight')
 
 
-def plotActivityOverWeek(data: pd.DataFrame, user: str, save_dir: str = None):
+def plotActivityOverWeek(cube: pd.DataFrame, user: str, save_dir: str = None):
     plotName = "activity-over-week"
 
-    noGroup = data[data["chat_with"] != "GROUP"]
-
-    noGroup["sent_by_user"] = noGroup["sender_name"] == user
+    noGroup = cube[cube["chat_with"] != "GROUP"]
 
-    plotting = noGroup.groupby(["weekday", "sent_by_user"], as_index=True).agg([
-        'count']).reset_index()
+    plotting = noGroup.groupby(["weekday", "sent_by_user"], observed=True)[
+        "messages"].sum().reset_index()
 
-    numberOfDays = len(pd.period_range(min(data["date"]), max(data["date"])))
+    numberOfDays = getDaysNumber(cube)
 
-    plotting["average_messages_per_day"] = plotting[(
-        'sender_name', 'count')]/(numberOfDays/7)
+    plotting["average_messages_per_day"] = plotting["messages"] / \
+        (numberOfDays/7)
 
-    plotting["message_direction"] = plotting["sent_by_user"].apply(
-        lambda x: 'Sent' if x else 'Received')
-
-    cats = ['Monday', 'Tuesday', 'Wednesday',
-            'Thursday', 'Friday', 'Saturday', 'Sunday']
-
-    cat_type = pd.api.types.CategoricalDtype(categories=cats, ordered=True)
-
-    plotting['weekday'] = plotting['weekday'].astype(cat_type)
+    plotting["message_direction"] = getDirectionNames(
+        plotting["sent_by_user"])
 
     kwargs = {"saturation": 0.5}
 
@@ -208,108 +213,193 @@ def plotActivityOverWeek(data: pd.DataFrame, user: str, save_dir: str = None):
         g.savefig(fullPath)
 
 
-def plotActivityOverDay(data: pd.DataFrame, user: str, save_dir: str = None):
+def plotActivityOverDay(cube: pd.DataFrame, user: str, save_dir: str = None):
     plotName = "activity-over-day"
-    noGroup = data[data["chat_with"] != "GROUP"]
-
-    noGroup["sent_by_user"] = noGroup["sender_name"] == user
+    noGroup = cube[cube["chat_with"] != "GROUP"]
 
-    plotting = noGroup.groupby(
-        ["hour", "sent_by_user"]).agg("count").reset_index()
+    plotting = noGroup.groupby(["hour", "sent_by_user"], observed=True)[
+        "messages"].sum().reset_index()
 
-    numberOfHours = len(pd.period_range(min(data["date"]), max(data["date"])))
+    numberOfHours = getDaysNumber(cube)
 
-    plotting["avg_messages_per_hour"] = plotting["sender_name"]/numberOfHours
+    plotting["avg_messages_per_hour"] = plotting["messages"]/numberOfHours
 
-    plotting["message_direction"] = plotting["sent_by_user"].apply(
-        lambda x: 'Sent' if x else 'Received')
+    plotting["message_direction"] = getDirectionNames(
+        plotting["sent_by_user"])
 
     plotting["hour_num"] = plotting["hour"].astype(int)
 
-    g = sns.lmplot(data=plotting, x="hour_num", y="avg_messages_per_hour",
-                   hue="message_direction", scatter=False, order=4, legend_out=False, aspect=1.7, palette="Set1")
+    trends = getTrends(plotting, x="hour_num", y="avg_messages_per_hour",
+                       hue="message_direction", order=4, ci=95)
+    fig, ax = drawTrends(
+        trends, legend_title="message_direction", palette="Set1")
 
-    g.axes[0, 0].xaxis.set_major_locator(
+    ax.xaxis.set_major_locator(
         MultipleLocator(2))
-    g.set(xlim=(0, 23))
-    g.set(ylim=(0, None))
+    ax.set_xlim(0, 23)
+    ax.set_ylim(0, None)
 
-    g.ax.legend(loc=2)
+    ax.legend(loc=2)
 
     plt.subplots_adjust(top=0.9)
-    g.fig.suptitle("Average messages number over day")
-    g.axes[0, 0].set_xlabel('Hour')
-    g.axes[0, 0].set_ylabel('Number of messages')
+    fig.suptitle("Average messages number over day")
+    ax.set_xlabel('Hour')
+    ax.set_ylabel('Number of messages')
 
     if save_dir == None:
         plt.show()
     else:
         assertDir(save_dir)
         fullPath = os.path.join(save_dir, plotName+".png")
-        g.savefig(fullPath)
+        fig.savefig(fullPath, bbox_inches='tight')
 
 
-def generateKeywordClouds(data: pd.DataFrame, user: str, language: str = "polish", chats: int = 6, keyword_numbers=(20, 17, 6, 3), save_dir: str = None, clouds_subdir: str = None, background_color: str = "white", lemmatize: bool = False):
-    plotName = "keywordCloud"
+def getCloudSeed(name: str) -> int:
+    # the same chat always gets the same cloud, whichever process draws it
+    return zlib.crc32(str(name).encode('utf-8'))
 
-    noGroup = data[data["chat_with"] != "GROUP"]
-    noGroup = noGroup[noGroup["type"] == "Generic"]
-    noGroup = noGroup.dropna(subset=["content"])
 
-    plotDataSeries = noGroup["chat_with"].value_counts()[:chats]
-    names = [name[0] for name in plotDataSeries.items()]
+def initCloudWorker(extractor: NGramExtractor):
+    global CLOUD_EXTRACTOR
 
-    corpus = []
+    initAggWorker()
+    CLOUD_EXTRACTOR = extractor
 
-    for name in noGroup["chat_with"].unique():
-        oneChat = noGroup[noGroup["chat_with"] == name]
-        chatString = ". ".join(oneChat["content"].astype(str).values)
 
-        corpus.append(chatString)
+def drawKeywordCloud(extractor: NGramExtractor, name: str, wordSentences: list, keyword_numbers, fullPath: str = None, background_color: str = "white", window_size: int = 4, ranked: dict = None, previous_hash: str = None):
+    from wordcloud import WordCloud
 
-    extractor = NGramExtractor(
-        language=language, IDFCorpus=corpus, max_n=len(keyword_numbers))
+    # TextRank values of every n-gram order, the IDF weighting is cheap and not cached
+    ranked = dict() if ranked == None else ranked
+    keywordFreq = dict()
+
+    for n_gram, number in enumerate(keyword_numbers, start=1):
+        if n_gram in ranked:
+            keywordValue = extractor.get_id_values(ranked[n_gram])
+        else:
+            keywordValue = extractor.rankTokens(
+                wordSentences, n_gram=n_gram, window_size=window_size)
+            ranked[n_gram] = extractor.get_text_values(keywordValue)
 
-    for idx, name in enumerate(names):
-        oneChat = noGroup[noGroup["chat_with"] == name]
-        chatString = ". ".join(oneChat["content"].astype(str).values)
-        if(background_color == "black"):
-            fig = plt.figure()
-            fig.patch.set_facecolor('black')
+        newKeywords = extractor.selectKeywords(
+            keywordValue, keywords_number=number, n_gram=n_gram)
 
-        keywordFreq = dict()
+        for word, value in newKeywords:
+            keywordFreq[word.capitalize()] = 100*value
 
-        for n_gram, number in enumerate(keyword_numbers, start=1):
-            newKeywords = extractor.analyze(
-                chatString, keywords_number=number, n_gram=n_gram, window_size=4)
+    fontPath = os.path.abspath(os.path.join(FONT_PATH, FONT_NAME))
+    colormap = COLORS[getCloudSeed(name) % len(COLORS)]
 
-            for word, value in newKeywords:
-                keywordFreq[word.capitalize()] = 100*value
+    # the saved cloud is kept if the same keywords would be drawn the same way
+    figureHash = getFigureHash(
+        name, keywordFreq, background_color, FONT_NAME, colormap)
+    if fullPath != None and figureHash == previous_hash and os.path.exists(fullPath):
+        return fullPath, ranked, figureHash
 
-        fontPath = os.path.abspath(os.path.join(FONT_PATH, FONT_NAME))
+    if(background_color == "black"):
+        fig = plt.figure()
+        fig.patch.set_facecolor('black')
+
+    wordcloud = WordCloud(background_color=background_color, font_path=fontPath, colormap=colormap, width=2000,
+                          height=1200, random_state=getCloudSeed(name)).generate_from_frequencies(keywordFreq)
+    plt.figure(figsize=(30, 16))
+    plt.axis("off")
+    plt.title(name, fontdict={"fontsize": 50, "fontweight": 7}, pad=7)
+
+    plt.imshow(wordcloud, interpolation="bilinear")
+
+    if fullPath == None:
+        plt.show()
+    else:
+        plt.savefig(fullPath)
+        plt.close('all')
 
-        wordcloud = WordCloud(background_color=background_color, font_path=fontPath, colormap=random.choice(COLORS), width=2000,
-                              height=1200).generate_from_frequencies(keywordFreq)
-        plt.figure(figsize=(30, 16))
-        plt.axis("off")
-        plt.title(name, fontdict={"fontsize": 50, "fontweight": 7}, pad=7)
+    return fullPath, ranked, figureHash
 
-        plt.imshow(wordcloud, interpolation="bilinear")
 
-        if save_dir == None:
-            plt.show()
+def drawWorkerKeywordCloud(name: str, wordSentences: list, keyword_numbers, fullPath: str, background_color: str, window_size: int, ranked: dict, previous_hash: str):
+    return drawKeywordCloud(CLOUD_EXTRACTOR, name, wordSentences, keyword_numbers, fullPath=fullPath, background_color=background_color,
+                            window_size=window_size, ranked=ranked, previous_hash=previous_hash)
+
+
+def generateKeywordClouds(data: pd.DataFrame, user: str, language: str = "polish", chats: int = 6, keyword_numbers=(20, 17, 6, 3), save_dir: str = None, clouds_subdir: str = None, background_color: str = "white", lemmatize: bool = False, workers: int = 1, window_size: int = 4, cache_dir: str = None):
+    plotName = "keywordCloud"
+
+    noGroup = data[data["chat_with"] != "GROUP"]
+    noGroup = noGroup[noGroup["type"] == "Generic"]
+    noGroup = noGroup.dropna(subset=["content"])
+
+    plotDataSeries = getChatCounts(noGroup)[:chats]
+    names = [name[0] for name in plotDataSeries.items()]
+
+    extractor = NGramExtractor(
+        language=language, max_n=len(keyword_numbers))
+
+    # every chat is cleaned and tokenized once, for the IDF and the keywords
+    chatTokens = dict()
+    chatStrings = dict()
+    for name, oneChat in noGroup.groupby("chat_with", observed=True, sort=False):
+        chatStrings[name] = ". ".join(oneChat["content"].astype(str).values)
+        chatTokens[name] = extractor.get_word_sentences(chatStrings[name])
+
+    extractor.initIDFTokens(list(chatTokens.values()))
+
+    # TextRank is skipped for chats and n-gram orders whose text did not change
+    cacheKeys = {name: {n_gram: extractor.get_cache_key(chatStrings[name], n_gram, window_size)
+                        for n_gram in range(1, len(keyword_numbers) + 1)}
+                 for name in names}
+    cached = dict()
+    for name, keys in cacheKeys.items():
+        cached[name] = dict()
+        for n_gram, key in keys.items():
+            found, value = loadNLPEntry(key, cache_dir)
+            if found:
+                cached[name][n_gram] = value
+    missing = {name: [n_gram for n_gram in keys.keys() if n_gram not in cached[name]]
+               for name, keys in cacheKeys.items()}
+
+    if save_dir == None:
+        fullPaths = [None] * len(names)
+        previousHashes = [None] * len(names)
+    else:
+        if clouds_subdir == None:
+            fullDir = save_dir
         else:
-            assertDir(save_dir)
+            fullDir = os.path.join(save_dir, clouds_subdir)
+        assertDir(fullDir)
+
+        fullPaths = [os.path.join(fullDir, "-".join([plotName, str(idx), name])+".png")
+                     for idx, name in enumerate(names)]
+
+        figures = loadManifest(save_dir)
+        previousHashes = [figures.get(getFigureKey(fullPath, save_dir))
+                          for fullPath in fullPaths]
+
+    # clouds shown on screen are drawn one by one in the main process
+    workers = min(getWorkersNumber(workers), len(names))
+    if save_dir == None or workers <= 1:
+        clouds = [drawKeywordCloud(extractor, name, chatTokens[name], keyword_numbers, fullPath=fullPath, background_color=background_color,
+                                   window_size=window_size, ranked=cached[name], previous_hash=previousHash)
+                  for name, fullPath, previousHash in zip(names, fullPaths, previousHashes)]
+    else:
+        # the fitted extractor is sent to every worker once, chats are sent one by one
+        with ProcessPoolExecutor(max_workers=workers, initializer=initCloudWorker, initargs=(extractor,)) as executor:
+            futures = [executor.submit(drawWorkerKeywordCloud, name, chatTokens[name], keyword_numbers, fullPath, background_color, window_size, cached[name], previousHash)
+                       for name, fullPath, previousHash in zip(names, fullPaths, previousHashes)]
 
-            if clouds_subdir == None:
-                fullDir = save_dir
-            else:
-                fullDir = os.path.join(save_dir, clouds_subdir)
-                assertDir(fullDir)
+            clouds = [future.result() for future in futures]
+
+    # only the orders ranked in this run are written, cached entries stay untouched
+    for name, (_, ranked, _) in zip(names, clouds):
+        for n_gram in missing[name]:
+            saveNLPEntry(cacheKeys[name][n_gram], ranked[n_gram], cache_dir)
+    pruneNLPCache(cache_dir)
+
+    if save_dir != None:
+        recordFigures({getFigureKey(fullPath, save_dir): figureHash
+                       for fullPath, _, figureHash in clouds}, save_dir)
 
-            fullPath = os.path.join(
-                fullDir, "-".join([plotName, str(idx), name])+".png")
-            plt.savefig(fullPath)
+    return [fullPath for fullPath, _, _ in clouds]
 
 
 def plotMessageLengthDistributionPerChat(data: pd.DataFrame, user: str, chats: int = 6, bins: int = 12, save_dir: str = None):
@@ -318,18 +408,17 @@ def plotMessageLengthDistributionPerChat(data: pd.DataFrame, user: str, chats: i
     generic = data[data["type"] == "Generic"]
     noGroup = generic[generic["chat_with"] != "GROUP"]
 
-    plotDataSeries = noGroup["chat_with"].value_counts()[:chats]
+    plotDataSeries = getChatCounts(noGroup)[:chats]
     names = [name[0] for name in plotDataSeries.items()]
 
     plotting = noGroup.dropna(subset=["content"])
 
     plotting = plotting[plotting["chat_with"].isin(names)]
 
-    plotting["message_length"] = plotting["content"].apply(countWords)
     plotting = plotting[plotting["message_length"] > 0]
 
-    plotting["message_direction"] = plotting["sender_name"].apply(
-        lambda x: "Sent" if x == user else "Received")
+    plotting["message_direction"] = getDirectionNames(
+        plotting["sender_name"] == user)
 
     cat_type = pd.api.types.CategoricalDtype(categories=names, ordered=True)
 
@@ -374,7 +463,7 @@ def plotAverageMessageLength(data: pd.DataFrame, user: str, chats: int = 20, mes
 
     noGroup = data[data["chat_with"] != "GROUP"]
     noGroup = noGroup[noGroup["type"] == "Generic"]
-    allNames = noGroup["chat_with"].value_counts()
+    allNames = getChatCounts(noGroup)
 
     namesNum = (int(len(allNames)*messages_treshold)
                 ) if (int(len(allNames)*messages_treshold)) > chats else chats
@@ -383,12 +472,11 @@ def plotAverageMessageLength(data: pd.DataFrame, user: str, chats: int = 20, mes
 
     prep = noGroup[noGroup["chat_with"].isin(possibleNames)]
     prep = prep.dropna(subset=["content"])
-    prep["message_length"] = prep["content"].apply(countWords)
     prep = prep[prep["message_length"] > 0]
-    prep["message_direction"] = prep["sender_name"].apply(
-        lambda x: "Sent" if x == user else "Received")
+    prep["message_direction"] = getDirectionNames(prep["sender_name"] == user)
 
-    names = prep.groupby("chat_with").mean().reset_index()
+    names = prep.groupby("chat_with", observed=True)[
+        "message_length"].mean().reset_index()
 
     names = names.sort_values(["message_length"], ascending=False)
 
@@ -420,41 +508,50 @@ def plotAverageMessageLength(data: pd.DataFrame, user: str, chats: int = 20, mes
         ax.figure.savefig(fullPath, bbox_inches='tight')
 
 
-def plotLanguageDiversityRank(data: pd.DataFrame, user: str, language: str, chats: int = 20, batch_size: int = 500, messages_treshold: int = 0.05, save_dir: str = None):
+def plotLanguageDiversityRank(data: pd.DataFrame, user: str, language: str, chats: int = 20, batch_size: int = 500, messages_treshold: int = 0.05, save_dir: str = None, pipe_batch_size: int = 4, workers: int = 1, cache_dir: str = None, method: str = "batches", messages_batch_size: int = 256):
     plotName = "language-diversity-rank"
 
     noGroup = data[data["chat_with"] != "GROUP"]
     prep = noGroup[noGroup["type"] == "Generic"]
 
-    prep["message_direction"] = prep["sender_name"].apply(
-        lambda x: "Sent" if x == user else "Received")
+    prep["message_direction"] = getDirectionNames(prep["sender_name"] == user)
 
-    allNames = prep["chat_with"].value_counts()
+    allNames = getChatCounts(prep)
 
     namesNum = (int(len(allNames)*messages_treshold)
                 ) if (int(len(allNames)*messages_treshold)) > chats else chats
 
     possibleNames = allNames.index[:namesNum]
 
-    model = getModel(language=language)
+    # all texts missing from the cache are streamed through one spaCy pipe
+    if method == "moving":
+        chatMessages = dict()
+        for name in possibleNames:
+            for direction, messages in getChatMessages(prep, chat=name).items():
+                chatMessages[(name, direction)] = messages
+
+        scores = getMovingDiversityScores(language, chatMessages, window_size=batch_size,
+                                          pipe_batch_size=messages_batch_size, workers=getWorkersNumber(workers), cache_dir=cache_dir)
+    else:
+        chatStrings = dict()
+        for name in possibleNames:
+            for direction, batches in getChatStrings(prep, chat=name).items():
+                chatStrings[(name, direction)] = batches
+
+        scores = getDiversityScores(language, chatStrings, batch_size=batch_size,
+                                    pipe_batch_size=pipe_batch_size, workers=getWorkersNumber(workers), cache_dir=cache_dir)
+
+    pruneNLPCache(cache_dir)
 
     ranks = list()
     for name in possibleNames:
-        chatStrings = getChatStrings(prep, chat=name)
         rankRow = [name]
 
         for direction in ["Sent", "Received"]:
-            scores = list()
-            for batch in chatStrings[direction]:
-                doc = model(batch)
-                score = calculateDiversity(
-                    doc, batch_size=batch_size)
-
-                if(score != None):
-                    scores.append(score)
+            directionScores = scores[(name, direction)]
 
-            if(len(scores) > 0):
-                meanDirectionalScore = sum(scores)/len(scores)
+            if(len(directionScores) > 0):
+                meanDirectionalScore = sum(directionScores)/len(directionScores)
                 rankRow.append(meanDirectionalScore)
             else:
                 rankRow.append(0)
@@ -478,6 +575,15 @@ def plotLanguageDiversityRank(data: pd.DataFrame, user: str, language: str, chat
         "Sent", "Received"], value_name="Score", var_name="message_direction")
 
     kwargs = {"alpha": 0.5}
+
+    # the saved rank is kept if the same scores would be drawn in the same order
+    figureHash = getFigureHash(
+        plotName, getFrameHash(plotting), list(sortedNames), kwargs)
+    if save_dir != None:
+        fullPath = os.path.join(save_dir, plotName+".png")
+        if isFigureCurrent(loadManifest(save_dir), fullPath, save_dir, figureHash):
+            return
+
     plt.figure(figsize=(9, 12))
     ax = sns.barplot(data=plotting, y="Chat", hue="message_direction",
                      x="Score", orient="h", palette="Set1", dodge=False, errwidth=0, **kwargs)
@@ -491,5 +597,6 @@ def plotLanguageDiversityRank(data: pd.DataFrame, user: str, language: str, chat
         plt.show()
     else:
         assertDir(save_dir)
-        fullPath = os.path.join(save_dir, plotName+".png")
         ax.figure.savefig(fullPath, bbox_inches='tight')
+        recordFigures(
+            {getFigureKey(fullPath, save_dir): figureHash}, save_dir)
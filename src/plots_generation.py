@@ -1,34 +1,136 @@
+import os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-from .plots import plotMessagesInChats, plotActivityOverTime, plotActivityForMostFrequentNonGroupChats, plotActivityOverWeek, plotActivityOverDay, plotMessageLengthDistributionPerChat, plotAverageMessageLength, generateKeywordClouds, plotLanguageDiversityRank
 from .parameters import getParam
+from .aggregates import getActivityCube
+from .utils import getWorkersNumber, initAggWorker
+from .figure_manifest import getFrameHash, getFigureHash, getFigureKey, loadManifest, recordFigures, isFigureCurrent
 
 USER = getParam('user')
 LANGUAGE = getParam('language')
 PLOTS_DIR = getParam('plotsDirectory')
+PLOT_WORKERS = getParam('plotting')['workers']
+CACHE_DIR = getParam('cacheDirectory')
 WORDCLOUDS_SUBDIR = getParam('wordClouds')['subDirectory']
+WORDCLOUDS_WORKERS = getParam('wordClouds')['workers']
+DIVERSITY_PIPE_BATCH_SIZE = getParam('languageDiversity')['pipeBatchSize']
+DIVERSITY_WORKERS = getParam('languageDiversity')['workers']
+DIVERSITY_METHOD = getParam('languageDiversity')['method']
+DIVERSITY_MESSAGES_BATCH_SIZE = getParam('languageDiversity')['messagesPipeBatchSize']
 
+# plots independent of each other: function name, figure file, input name, arguments
+PLOT_TASKS = [
+    ("plotMessagesInChats", "messages-in-chats.png",
+     "cube", dict(chats=15, user=USER)),
+    ("plotActivityOverTime", "activity-over-time.png",
+     "cube", dict(user=USER, order=6)),
+    ("plotActivityForMostFrequentNonGroupChats", "activity-for-most-frequent-non-group-chats.png",
+     "cube", dict(chats=4, order=3)),
+    ("plotActivityOverWeek", "activity-over-week.png", "cube", dict(user=USER)),
+    ("plotActivityOverDay", "activity-over-day.png", "cube", dict(user=USER)),
+    ("plotMessageLengthDistributionPerChat", "message-length-distribution-per-chat.png",
+     "messages", dict(user=USER)),
+    ("plotAverageMessageLength", "average-message-length-in-significant-chats.png",
+     "messages", dict(user=USER, chats=20, messages_treshold=0.1)),
+]
 
-def generatePlots(data: pd.DataFrame):
-    plotMessagesInChats(data, chats=15, user=USER, save_dir=PLOTS_DIR)
+# inputs of the plot tasks, set once in every worker by the pool initializer
+PLOT_INPUTS = dict()
 
-    plotActivityOverTime(data, user=USER, save_dir=PLOTS_DIR, order=6)
 
-    plotActivityForMostFrequentNonGroupChats(
-        data, chats=4, order=3, save_dir=PLOTS_DIR)
+def getPlotMessages(data: pd.DataFrame) -> pd.DataFrame:
+    # message length plots only check if the content is missing
+    messages = data[["chat_with", "sender_name",
+                     "type", "message_length"]].copy()
+    messages["content"] = data["content"].where(data["content"].isna(), "")
 
-    plotActivityOverWeek(data, user=USER, save_dir=PLOTS_DIR)
+    return messages
 
-    plotActivityOverDay(data, user=USER, save_dir=PLOTS_DIR)
 
-    plotMessageLengthDistributionPerChat(
-        data, user=USER, save_dir=PLOTS_DIR)
+def setPlotInputs(inputs: dict):
+    global PLOT_INPUTS
+    PLOT_INPUTS = inputs
 
-    plotAverageMessageLength(
-        data, user=USER, chats=20, messages_treshold=0.1, save_dir=PLOTS_DIR)
+
+def initPlotWorker(inputs: dict):
+    initAggWorker()
+    setPlotInputs(inputs)
+
+
+def renderPlot(functionName: str, inputName: str, kwargs: dict, save_dir: str = PLOTS_DIR) -> str:
+    import matplotlib.pyplot as plt
+    from . import plots
+
+    getattr(plots, functionName)(
+        PLOT_INPUTS[inputName], save_dir=save_dir, **kwargs)
+
+    # the next plot drawn by this process starts on a new figure
+    plt.close('all')
+
+    return functionName
+
+
+def generateTextPlots(data: pd.DataFrame, save_dir: str = PLOTS_DIR):
+    from .plots import generateKeywordClouds, plotLanguageDiversityRank
 
     generateKeywordClouds(
-        data, user=USER, language=LANGUAGE, chats=10, save_dir=PLOTS_DIR, clouds_subdir=WORDCLOUDS_SUBDIR, background_color="white")
+        data, user=USER, language=LANGUAGE, chats=10, save_dir=save_dir, clouds_subdir=WORDCLOUDS_SUBDIR, background_color="white", workers=WORDCLOUDS_WORKERS, cache_dir=CACHE_DIR)
 
     plotLanguageDiversityRank(
-        data, user=USER, language=LANGUAGE, save_dir=PLOTS_DIR, batch_size=500)
+        data, user=USER, language=LANGUAGE, save_dir=save_dir, batch_size=500, pipe_batch_size=DIVERSITY_PIPE_BATCH_SIZE, workers=DIVERSITY_WORKERS, cache_dir=CACHE_DIR, method=DIVERSITY_METHOD, messages_batch_size=DIVERSITY_MESSAGES_BATCH_SIZE)
+
+
+def getStaleTasks(inputs: dict, save_dir: str) -> list:
+    figures = loadManifest(save_dir)
+    inputHashes = {inputName: getFrameHash(frame)
+                   for inputName, frame in inputs.items()}
+
+    # a figure is drawn again only if its input or arguments changed
+    staleTasks = list()
+    for functionName, fileName, inputName, kwargs in PLOT_TASKS:
+        fullPath = os.path.join(save_dir, fileName)
+        figureHash = getFigureHash(
+            functionName, kwargs, inputHashes[inputName])
+
+        if not isFigureCurrent(figures, fullPath, save_dir, figureHash):
+            staleTasks.append((functionName, inputName, kwargs,
+                               getFigureKey(fullPath, save_dir), figureHash))
+
+    return staleTasks
+
+
+def generatePlots(data: pd.DataFrame, workers: int = PLOT_WORKERS, save_dir: str = PLOTS_DIR):
+    inputs = {"cube": getActivityCube(data, user=USER),
+              "messages": getPlotMessages(data)}
+
+    staleTasks = getStaleTasks(inputs, save_dir)
+    figureHashes = {figureKey: figureHash
+                    for _, _, _, figureKey, figureHash in staleTasks}
+
+    workers = min(getWorkersNumber(workers), len(staleTasks))
+
+    if workers <= 1:
+        setPlotInputs(inputs)
+        for functionName, inputName, kwargs, _, _ in staleTasks:
+            renderPlot(functionName, inputName, kwargs, save_dir)
+        recordFigures(figureHashes, save_dir)
+
+        generateTextPlots(data, save_dir)
+        return
+
+    # the inputs are sent to every worker once, tasks carry only the plot names
+    with ProcessPoolExecutor(max_workers=workers, initializer=initPlotWorker, initargs=(inputs,)) as executor:
+        futures = [executor.submit(renderPlot, functionName, inputName, kwargs, save_dir)
+                   for functionName, inputName, kwargs, _, _ in staleTasks]
+
+        # keyword clouds and diversity have their own workers, they run meanwhile
+        try:
+            generateTextPlots(data, save_dir)
+        finally:
+            # figures rendered by the pool are recorded even if the text plots fail
+            recordFigures({figureKey: figureHash for future, (_, _, _, figureKey, figureHash) in zip(futures, staleTasks)
+                           if future.exception() == None}, save_dir)
+
+        for future in futures:
+            future.result()
@@ -0,0 +1,54 @@
+import pandas as pd
+from pandas.api.types import CategoricalDtype, union_categoricals
+
+# fields read from every message record, everything else (photos,
+# reactions, shares, stickers...) is dropped while parsing
+MESSAGE_FIELDS = ["sender_name", "timestamp_ms", "content", "type"]
+
+MESSAGE_SCHEMA = {
+    "sender_name": "category",
+    "timestamp_ms": "int64",
+    "content": "object",
+    "type": "category",
+    "chat_with": "category",
+    "participants_number": "int16",
+    "thread": "category",
+}
+
+
+def projectMessages(records: list) -> pd.DataFrame:
+    return pd.DataFrame({field: [record.get(field) for record in records]
+                         for field in MESSAGE_FIELDS})
+
+
+def applySchema(data: pd.DataFrame) -> pd.DataFrame:
+    for column, dtype in MESSAGE_SCHEMA.items():
+        if column in data.columns:
+            data[column] = data[column].astype(dtype)
+
+    return data
+
+
+def getEmptyMessages() -> pd.DataFrame:
+    return applySchema(pd.DataFrame({column: [] for column in MESSAGE_SCHEMA}))
+
+
+def concatMessages(dataFrames: list) -> pd.DataFrame:
+    dataFrames = [data for data in dataFrames if len(data) > 0]
+
+    if len(dataFrames) == 0:
+        return getEmptyMessages()
+
+    # pd.concat falls back to object columns unless categories match
+    for column, dtype in MESSAGE_SCHEMA.items():
+        if dtype != "category":
+            continue
+
+        categories = union_categoricals(
+            [data[column] for data in dataFrames]).categories
+        unified = CategoricalDtype(categories=categories)
+
+        for data in dataFrames:
+            data[column] = data[column].astype(unified)
+
+    return pd.concat(dataFrames, ignore_index=True, sort=False)
@@ -0,0 +1,122 @@
+import json
+import random
+import zipfile
+
+from .parameters import getParam
+from .n_gram_extractor import getStopwords
+
+USER = getParam('user')
+
+WORDS = {
+    "polish": ["kot", "pies", "dom", "praca", "szkoła", "jutro", "wczoraj", "obiad", "kawa",
+               "herbata", "samochód", "pociąg", "spotkanie", "wieczór", "książka", "film",
+               "muzyka", "zakupy", "pogoda", "deszcz", "słońce", "zadanie", "egzamin",
+               "wakacje", "góry", "morze", "rower", "mecz", "urodziny", "prezent", "żółw",
+               "źródło", "gęś", "łódź", "ćma", "zażółć", "gęślą", "jaźń", "dziękuję", "cześć"],
+    "english": ["cat", "dog", "house", "work", "school", "tomorrow", "yesterday", "dinner",
+                "coffee", "tea", "car", "train", "meeting", "evening", "book", "movie",
+                "music", "shopping", "weather", "rain", "sun", "homework", "exam", "holiday",
+                "mountains", "sea", "bike", "match", "birthday", "present", "thanks", "hello",
+                "café", "naïve", "résumé", "jalapeño", "über", "fiancée", "déjà", "vu"],
+}
+
+FIRST_NAMES = ["Anna", "Piotr", "Kasia", "Tomasz", "Zofia", "Łukasz", "Małgorzata", "Paweł",
+               "Agnieszka", "Michał", "John", "Emily", "Jakub", "Ewa", "Grzegorz", "Żaneta"]
+LAST_NAMES = ["Nowak", "Kowalski", "Wiśniewska", "Wójcik", "Kowalczyk", "Kamińska", "Lewandowski",
+              "Zieliński", "Szymańska", "Woźniak", "Dąbrowski", "Smith", "Brown", "Jankowska"]
+
+MESSAGE_TYPES = ["Generic"] * 17 + ["Share", "Call", "Subscribe"]
+
+
+def encodeMojibake(text: str) -> bytes:
+    # the export escapes every utf-8 byte of non-ascii characters separately
+    return b''.join(('\\u00%02x' % byte).encode() if byte > 127 else bytes([byte])
+                    for byte in text.encode('utf-8'))
+
+
+def getSentence(rng: random.Random, words: list, stopwords: list) -> str:
+    length = max(1, int(rng.expovariate(1 / 8)))
+    sentence = [rng.choice(stopwords) if (stopwords and rng.random() < 0.4) else rng.choice(words)
+                for _ in range(length)]
+
+    if rng.random() < 0.05:
+        sentence.append("https://example.com/" + str(rng.randint(0, 10**6)))
+    if rng.random() < 0.05:
+        sentence.append(rng.choice(words) + rng.choice(words)[-1] * rng.randint(3, 6))
+
+    return " ".join(sentence)
+
+
+def getMessage(rng: random.Random, sender: str, timestamp: int, words: list, stopwords: list) -> dict:
+    messageType = rng.choice(MESSAGE_TYPES)
+    message = {"sender_name": sender, "timestamp_ms": timestamp, "type": messageType}
+
+    if messageType == "Generic":
+        if rng.random() < 0.1:
+            message["photos"] = [{"uri": "messages/photos/{}.jpg".format(timestamp),
+                                  "creation_timestamp": timestamp // 1000}]
+        else:
+            sentences = [getSentence(rng, words, stopwords)
+                         for _ in range(rng.randint(1, 3))]
+            message["content"] = ". ".join(sentences)
+    elif messageType == "Share":
+        message["share"] = {"link": "https://example.com"}
+        message["content"] = "https://example.com"
+    elif messageType == "Call":
+        message["call_duration"] = rng.randint(0, 3600)
+
+    if rng.random() < 0.05:
+        message["reactions"] = [{"reaction": "❤", "actor": sender}]
+
+    return message
+
+
+def generateExport(path: str, chats: int = 50, messages: int = 100000, group_ratio: float = 0.2, language: str = "polish", user: str = USER, seed: int = 0, messages_per_file: int = 10000, end_ms: int = 1590000000000, days: int = 1500):
+    rng = random.Random(seed)
+    words = WORDS.get(language, WORDS["english"])
+    stopwords = sorted(getStopwords(language))
+
+    # chat sizes follow a long tailed distribution, like real inboxes
+    weights = [1 / (rank + 1) for rank in range(chats)]
+    sizes = [max(1, int(messages * weight / sum(weights))) for weight in weights]
+
+    usedNames = set([user])
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zipF:
+        for chatIdx, size in enumerate(sizes):
+            isGroup = rng.random() < group_ratio
+            participantsNumber = rng.randint(3, 8) if isGroup else 2
+
+            participants = [user]
+            while len(participants) < participantsNumber:
+                name = " ".join([rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)])
+                if name in usedNames:
+                    name = name + " " + str(len(usedNames))
+                usedNames.add(name)
+                participants.append(name)
+
+            title = "Group {}".format(chatIdx) if isGroup else participants[1]
+            threadDir = "{}_{}".format("".join(title.split()).lower(), chatIdx)
+
+            timestamps = sorted((end_ms - rng.randint(0, days * 86400 * 1000)
+                                 for _ in range(size)), reverse=True)
+
+            chatMessages = [getMessage(rng, rng.choice(participants), timestamp, words, stopwords)
+                            for timestamp in timestamps]
+
+            for fileIdx, start in enumerate(range(0, size, messages_per_file), start=1):
+                conversation = {
+                    "participants": [{"name": name} for name in participants],
+                    "messages": chatMessages[start:start + messages_per_file],
+                    "title": title,
+                    "is_still_participant": True,
+                    "thread_type": "RegularGroup" if isGroup else "Regular",
+                    "thread_path": "inbox/" + threadDir,
+                }
+
+                fileDir = "messages/inbox/{}/message_{}.json".format(
+                    threadDir, fileIdx)
+                zipF.writestr(fileDir, encodeMojibake(
+                    json.dumps(conversation, ensure_ascii=False, indent=2)))
+
+    return path
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+TREND_POINTS = 100
+
+
+def getGroups(values: pd.Series) -> pd.Categorical:
+    # categories keep their order, other values are ordered by appearance
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.Categorical(values)
+
+    return pd.Categorical(values, categories=pd.unique(values))
+
+
+def getPowers(values: np.ndarray, center: float, scale: float, order: int) -> np.ndarray:
+    # x is scaled to [-1, 1], powers of raw timestamps would lose all precision
+    scaled = (values - center) / scale
+
+    return scaled[..., np.newaxis] ** np.arange(order + 1)
+
+
+def getTrends(data: pd.DataFrame, x: str, y: str, hue: str, order: int = 1, ci: float = 95, points: int = TREND_POINTS) -> pd.DataFrame:
+    """Least squares polynomial of y over x for every hue group, with the confidence band of the fit"""
+
+    groups = getGroups(data[hue])
+    xs = data[x].to_numpy(dtype=float)
+    ys = data[y].to_numpy(dtype=float)
+
+    valid = (groups.codes >= 0) & np.isfinite(xs) & np.isfinite(ys)
+    codes, xs, ys = groups.codes[valid], xs[valid], ys[valid]
+    groupsNumber = len(groups.categories)
+    size = order + 1
+
+    if len(xs) == 0:
+        return pd.DataFrame({"group": pd.Categorical([], categories=groups.categories),
+                             "x": [], "y": [], "low": [], "high": []})
+
+    center = (xs.max() + xs.min()) / 2
+    scale = (xs.max() - xs.min()) / 2 or 1
+    powers = getPowers(xs, center, scale, order)
+
+    # normal equations of all groups at once, one bincount per matrix cell
+    xtx = np.stack([np.bincount(codes, weights=powers[:, i] * powers[:, j], minlength=groupsNumber)
+                    for i in range(size) for j in range(size)], axis=1).reshape(groupsNumber, size, size)
+    xty = np.stack([np.bincount(codes, weights=powers[:, i] * ys, minlength=groupsNumber)
+                    for i in range(size)], axis=1)
+
+    inverse = np.linalg.pinv(xtx)
+    coefficients = np.einsum('gij,gj->gi', inverse, xty)
+
+    # every curve spans only the x range of its own group
+    counts = np.bincount(codes, minlength=groupsNumber)
+    mins = pd.Series(xs).groupby(codes).min().reindex(
+        range(groupsNumber)).to_numpy()
+    maxs = pd.Series(xs).groupby(codes).max().reindex(
+        range(groupsNumber)).to_numpy()
+    grid = mins[:, np.newaxis] + (maxs - mins)[:, np.newaxis] * \
+        np.linspace(0, 1, points)[np.newaxis, :]
+
+    gridPowers = getPowers(grid, center, scale, order)
+    fit = np.einsum('gkp,gp->gk', gridPowers, coefficients)
+
+    low = np.full(fit.shape, np.nan)
+    high = np.full(fit.shape, np.nan)
+
+    if ci != None:
+        residuals = ys - np.einsum('np,np->n', powers, coefficients[codes])
+        rss = np.bincount(codes, weights=residuals ** 2,
+                          minlength=groupsNumber)
+
+        freedom = counts - size
+        hasBand = freedom > 0
+        sigma2 = np.where(hasBand, rss / np.maximum(freedom, 1), np.nan)
+
+        # variance of the fitted mean at every grid point
+        variance = sigma2[:, np.newaxis] * np.einsum(
+            'gkp,gpq,gkq->gk', gridPowers, inverse, gridPowers)
+        quantile = stats.t.ppf((1 + ci / 100) / 2, np.maximum(freedom, 1))
+        halfWidth = quantile[:, np.newaxis] * \
+            np.sqrt(np.clip(variance, 0, None))
+
+        low = fit - halfWidth
+        high = fit + halfWidth
+
+    present = counts > 0
+    groupCodes = np.repeat(np.arange(groupsNumber)[present], points)
+
+    return pd.DataFrame({"group": pd.Categorical.from_codes(groupCodes, categories=groups.categories),
+                         "x": grid[present].ravel(),
+                         "y": fit[present].ravel(),
+                         "low": low[present].ravel(),
+                         "high": high[present].ravel()})
@@ -1,12 +1,32 @@
-import re
 import os
+import numpy as np
 import pandas as pd
 
 
-def countWords(text: str) -> int:
-    pattern = r"[^\W|\d]+"
-    words = re.findall(pattern, text)
-    return len(words)
+WORDS_PATTERN = r"[^\W|\d]+"
+
+
+def datesToTimestamps(dates: pd.Series) -> np.ndarray:
+    return dates.values.astype('datetime64[s]').astype(float)
+
+
+def countWordsColumn(content: pd.Series) -> pd.Series:
+    # still one regex search per message, it pays off by running once per parse
+    return content.fillna("").str.count(WORDS_PATTERN).astype('int32')
+
+
+def getWorkersNumber(workers: int = None) -> int:
+    if workers == None or workers < 1:
+        return os.cpu_count() or 1
+
+    return workers
+
+
+def initAggWorker():
+    import matplotlib.pyplot as plt
+
+    # workers only save figures, they never open windows
+    plt.switch_backend("Agg")
 
 
 def assertDir(directory: str):
@@ -1,86 +1,394 @@
 import zipfile
+import codecs
 import os
 import pandas as pd
 import re
 from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import json
 
 from .parameters import getParam
-from .anonymize import changeNames
+from .utils import countWordsColumn, getWorkersNumber
+from .anonymize import changeNames, SEED
+from .schema import projectMessages, applySchema, concatMessages
+from .cache import CACHE_DIR, getCacheKey, loadMessages, saveMessages
+from .incremental import loadStore, saveStore, getChangedFiles, recordFiles, getLatestTimestamps, mergeMessages
 
 DEFAULT_ZIP_FOLDER = getParam('dataZipDirectory')
-DEFAULT_OUTPUT_FILE = getParam('allMessagesFile')
 USER = getParam('user')
 TIMEZONE = getParam('timezone')
 ANONYMIZE = getParam('anonymize')
+PARSE_WORKERS = getParam('parsing')['workers']
+INCREMENTAL = getParam('parsing')['incremental']
 
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday',
+            'Thursday', 'Friday', 'Saturday', 'Sunday']
 
-def getZipPath(folderName: str = DEFAULT_ZIP_FOLDER, user: str = USER) -> str:
+STREAM_CHUNK_BYTES = 1 << 20
+STREAM_CHUNK_MESSAGES = 10000
+
+PART_PATTERN = re.compile(r'^(.+)_(\d+)\.zip$')
+MOJIBAKE_PATTERN = re.compile(rb'\\u00([\da-f]{2})')
+WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+NUMBER_START = "-0123456789"
+NUMBER_CONTINUATION = ".eE+-"
+
+
+def getArchiveJSONNames(zipPath: str) -> set:
+    with zipfile.ZipFile(zipPath) as zipF:
+        return {name for name in zipF.namelist() if name.endswith(".json")}
+
+
+def splitExportParts(parts: list) -> list:
+    if len(parts) == 1:
+        return [parts]
+
+    # parts of one export hold different files, dated exports repeat the same ones
+    seen = set()
+    for zipPath in parts:
+        names = getArchiveJSONNames(zipPath)
+        if not seen.isdisjoint(names):
+            print("WARNING: " + ", ".join(map(os.path.basename, parts)) +
+                  " share conversation files, they are read as separate exports")
+            return [[zipPath] for zipPath in parts]
+        seen.update(names)
+
+    return [parts]
+
+
+def getExports(folderName: str = DEFAULT_ZIP_FOLDER) -> list:
+    exports = dict()
+
+    for fileName in os.listdir(folderName):
+        if not fileName.endswith(".zip"):
+            continue
+
+        match = PART_PATTERN.match(fileName)
+        if match:
+            stem, part = match.group(1), int(match.group(2))
+        else:
+            stem, part = fileName[:-len(".zip")], 0
+
+        exports.setdefault(stem, []).append(
+            (part, os.path.join(folderName, fileName)))
+
+    exportsParts = [export for parts in exports.values()
+                    for export in splitExportParts([path for _, path in sorted(parts)])]
+
+    # oldest export first
+    return sorted(exportsParts, key=lambda parts: max(map(os.path.getmtime, parts)))
+
+
+def getExportPaths(folderName: str = DEFAULT_ZIP_FOLDER, user: str = USER) -> list:
     prepName = ''.join(user.split()).lower()
 
-    filesNames = [file for file in os.listdir(folderName) if file.endswith(".zip") ]
+    exports = getExports(folderName)
 
-    if (len(filesNames) == 0):
+    if (len(exports) == 0):
         print("ERROR: put the zip file in ", folderName)
-        return None 
-    
-    if (len(filesNames) == 1):
-        return os.path.join(folderName, filesNames[0])
-    
-    for fileName in os.listdir(folderName):
-        if ((fileName.endswith(".zip")) and (str(prepName) in str(fileName))):
-            return os.path.join(folderName, fileName)
+        return None
+
+    if (len(exports) == 1):
+        return exports[0]
+
+    # the newest export of the user
+    for parts in reversed(exports):
+        if str(prepName) in os.path.basename(parts[0]):
+            return parts
 
     print("ERROR: No zip file for user ", USER)
     return None
 
 
-def getFileData(zipF: zipfile.ZipFile, fileDir: str) -> dict:
+def fixMojibakeStream(binData, chunk_bytes: int = STREAM_CHUNK_BYTES):
     fix_mojibake_escapes = partial(
-        re.compile(rb'\\u00([\da-f]{2})').sub,
+        MOJIBAKE_PATTERN.sub,
         lambda m: bytes.fromhex(m.group(1).decode()))
 
+    decoder = codecs.getincrementaldecoder('utf8')()
+    carry = b''
+
+    while True:
+        chunk = binData.read(chunk_bytes)
+        if not chunk:
+            break
+
+        chunk = carry + chunk
+
+        # an escape sequence may be cut by the chunk boundary
+        tailStart = chunk.rfind(b'\\', max(len(chunk) - 5, 0))
+        if tailStart == -1:
+            carry = b''
+        else:
+            carry = chunk[tailStart:]
+            chunk = chunk[:tailStart]
+
+        yield decoder.decode(fix_mojibake_escapes(chunk))
+
+    yield decoder.decode(fix_mojibake_escapes(carry), final=True)
+
+
+class JSONStreamReader():
+    def __init__(self, textChunks):
+        self.chunks = textChunks
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def readMore(self) -> bool:
+        if self.exhausted:
+            return False
+
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.exhausted = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            match = WHITESPACE_PATTERN.match(self.buffer, self.pos)
+            self.pos = match.end()
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.readMore():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError("Expected '{}' in JSON stream".format(char))
+        self.pos += 1
+
+    def isComplete(self, end: int) -> bool:
+        if self.exhausted or self.buffer[self.pos] not in NUMBER_START:
+            return True
+
+        # a number cut by the chunk boundary decodes as its shorter prefix, e.g. 1.5 of 1.5e10
+        return end < len(self.buffer) and self.buffer[end] not in NUMBER_CONTINUATION
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if self.isComplete(end):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+
+            if not self.readMore():
+                obj, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return obj
+
+    def items(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def elements(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+def iterConversation(zipF: zipfile.ZipFile, fileDir: str, chunk_messages: int = STREAM_CHUNK_MESSAGES, chunk_bytes: int = STREAM_CHUNK_BYTES):
     with zipF.open(fileDir) as binData:
-        repaired = fix_mojibake_escapes(binData.read())
+        reader = JSONStreamReader(fixMojibakeStream(binData, chunk_bytes))
 
-    return json.loads(repaired.decode('utf8'))
+        for key in reader.items():
+            if key != "messages":
+                yield key, reader.value()
+                continue
 
+            messages = []
+            for message in reader.elements():
+                messages.append(message)
 
-def extractOne(zipF: zipfile.ZipFile, fileDir: str, user: str = USER) -> pd.DataFrame:
-    conversation = getFileData(zipF, fileDir)
+                if len(messages) >= chunk_messages:
+                    yield key, messages
+                    messages = []
 
-    participants = list(conversation["participants"])
+            yield key, messages
+
+
+def getThread(fileDir: str) -> str:
+    return os.path.basename(os.path.dirname(fileDir))
+
+
+def extractOne(zipF: zipfile.ZipFile, fileDir: str, user: str = USER, since: int = None) -> pd.DataFrame:
+    participants = None
+    messageFrames = []
+
+    for key, value in iterConversation(zipF, fileDir):
+        if key == "participants":
+            participants = list(value)
+        elif key == "messages" and len(value) > 0:
+            messages = projectMessages(value)
+
+            if since != None:
+                isNew = messages["timestamp_ms"] >= since
+                messages = messages[isNew]
+
+                # messages are stored newest first, the rest is already known
+                if not isNew.all() and participants != None:
+                    messageFrames.append(messages)
+                    break
+
+            messageFrames.append(messages)
+
+    if participants == None:
+        participants = []
 
     coParticipantsList = [x["name"] for x in participants if x["name"] != user]
 
     coParticipant = coParticipantsList[0] if len(
         coParticipantsList) == 1 else "GROUP"
 
-    messages = pd.DataFrame(conversation["messages"])
+    if len(messageFrames) == 0:
+        messages = projectMessages([])
+    else:
+        messages = pd.concat(messageFrames, ignore_index=True, sort=False)
+
     messages["chat_with"] = coParticipant
     messages["participants_number"] = len(participants)
+    messages["thread"] = getThread(fileDir)
 
-    return messages
+    return applySchema(messages)
 
 
-def getDataFrame(folderName: str = DEFAULT_ZIP_FOLDER, user: str = USER, isAnonymous: bool = ANONYMIZE) -> pd.DataFrame:
-    zipPath = getZipPath(folderName=folderName, user=user)
+def extractFiles(files: list, user: str = USER, since: dict = None) -> list:
+    extracted = []
+    zipFiles = dict()
 
-    if zipPath == None:
-        return None
+    try:
+        for zipPath, fileDir in files:
+            if zipPath not in zipFiles.keys():
+                zipFiles[zipPath] = zipfile.ZipFile(zipPath)
 
-    dataFrames = []
+            threadSince = None if since == None else since.get(
+                getThread(fileDir))
+            try:
+                newChat = extractOne(
+                    zipFiles[zipPath], fileDir, user, threadSince)
+                extracted.append(((zipPath, fileDir), newChat))
+            except:
+                print("WARNING: Wrong chat syntax in " + fileDir)
+    finally:
+        for zipF in zipFiles.values():
+            zipF.close()
+
+    return extracted
+
+
+def listArchiveFiles(zipPaths: list) -> list:
+    found = dict()
+    duplicates = dict()
+
+    # a file repeated in several zips is taken from the newest one
+    for zipPath in sorted(zipPaths, key=os.path.getmtime, reverse=True):
+        with zipfile.ZipFile(zipPath) as zipF:
+            for info in zipF.infolist():
+                if not info.filename.endswith(".json"):
+                    continue
+
+                if info.filename in found:
+                    pair = (found[info.filename][0], zipPath)
+                    duplicates[pair] = duplicates.get(pair, 0) + 1
+                else:
+                    found[info.filename] = (zipPath, info)
+
+    for (keptPath, skippedPath), count in duplicates.items():
+        print("WARNING: {} conversation files of {} are also in {}, the newer copies are used".format(
+            count, os.path.basename(skippedPath), os.path.basename(keptPath)))
+
+    files = list(found.values())
+
+    # files of one conversation may be spread over several parts,
+    # message_2.json has to follow message_1.json and precede message_10.json
+    files.sort(key=lambda file: (os.path.dirname(file[1].filename),
+                                 len(file[1].filename), file[1].filename))
+
+    return files
 
-    with zipfile.ZipFile(zipPath) as zipF:
-        for fileDir in zipF.namelist():
-            if fileDir.endswith(".json"):
-                try:
-                    newChat = extractOne(zipF, fileDir, user)
-                    dataFrames.append(newChat)
-                except:
-                    print("WARNING: Wrong chat syntax in "+ fileDir)
 
-    fullDataFrame = pd.concat(dataFrames, ignore_index=True)
+def partitionFiles(files: list, partitions: int) -> list:
+    bySize = sorted(files, key=lambda file: file[1].file_size, reverse=True)
+
+    # largest files first, each to the currently lightest partition
+    loads = [0] * partitions
+    parts = [[] for _ in range(partitions)]
+    for zipPath, info in bySize:
+        lightest = loads.index(min(loads))
+        parts[lightest].append((zipPath, info.filename))
+        loads[lightest] = loads[lightest] + info.file_size
+
+    return [part for part in parts if len(part) > 0]
+
+
+def extractArchive(files: list, user: str = USER, workers: int = PARSE_WORKERS, since: dict = None) -> list:
+    workers = getWorkersNumber(workers)
+
+    if workers == 1:
+        extracted = extractFiles(
+            [(zipPath, info.filename) for zipPath, info in files], user, since)
+    else:
+        extracted = []
+        partitions = partitionFiles(files, workers)
+
+        with ProcessPoolExecutor(max_workers=max(len(partitions), 1)) as executor:
+            futures = [executor.submit(extractFiles, part, user, since)
+                       for part in partitions]
+
+            for future in futures:
+                extracted.extend(future.result())
+
+    chats = dict(extracted)
+    fileKeys = [(zipPath, info.filename) for zipPath, info in files]
+
+    return [chats[fileKey] for fileKey in fileKeys if fileKey in chats]
+
+
+def getDataFrame(folderName: str = DEFAULT_ZIP_FOLDER, user: str = USER, isAnonymous: bool = ANONYMIZE, workers: int = PARSE_WORKERS, zipPaths: list = None) -> pd.DataFrame:
+    if zipPaths == None:
+        zipPaths = getExportPaths(folderName=folderName, user=user)
+
+    if zipPaths == None:
+        return None
+
+    dataFrames = extractArchive(listArchiveFiles(zipPaths), user, workers)
+
+    fullDataFrame = concatMessages(dataFrames)
 
     if isAnonymous:
         fullDataFrame = changeNames(fullDataFrame)
@@ -88,33 +396,95 @@ def getDataFrame(folderName: str = DEFAULT_ZIP_FOLDER, user: str = USER, isAnony
     return fullDataFrame
 
 
+def getIncrementalDataFrame(exports: list, cacheDir: str = CACHE_DIR, user: str = USER, workers: int = PARSE_WORKERS) -> pd.DataFrame:
+    stored, manifest = loadStore(cacheDir, user)
+
+    for zipPaths in exports:
+        changed = getChangedFiles(listArchiveFiles(zipPaths), manifest)
+
+        if len(changed) == 0:
+            continue
+
+        print("Merging {} new conversation files from {}".format(
+            len(changed), ", ".join(zipPaths)))
+
+        latest = getLatestTimestamps(stored)
+        dataFrames = extractArchive(changed, user, workers, since=latest)
+
+        if len(dataFrames) > 0:
+            stored = mergeMessages(stored, concatMessages(dataFrames))
+
+        recordFiles(changed, manifest)
+        saveStore(stored, manifest, cacheDir)
+
+    return stored
+
+
 def getDates(data: pd.DataFrame, timezone: str = TIMEZONE) -> pd.DataFrame:
-    data["date"] = pd.to_datetime(data["timestamp_ms"]*int(
-        1e6), errors="ignore").dt.tz_localize('UTC').dt.tz_convert(timezone).dt.strftime('%Y-%m-%d')
+    localTime = pd.to_datetime(data["timestamp_ms"], unit='ms', utc=True).dt.tz_convert(
+        timezone).dt.tz_localize(None)
 
-    data["weekday"] = pd.to_datetime(data["timestamp_ms"]*int(
-        1e6)).dt.tz_localize('UTC').dt.tz_convert(timezone).dt.strftime('%A')
+    data["date"] = localTime.dt.normalize()
 
-    data["yearday"] = pd.to_datetime(data["timestamp_ms"]*int(
-        1e6)).dt.tz_localize('UTC').dt.tz_convert(timezone).dt.strftime('%j')
+    data["weekday"] = pd.Categorical.from_codes(
+        localTime.dt.dayofweek.values, categories=WEEKDAYS, ordered=True)
 
-    data["hour"] = pd.to_datetime(data["timestamp_ms"]*int(
-        1e6)).dt.tz_localize('UTC').dt.tz_convert(timezone).dt.strftime('%H')
+    data["yearday"] = localTime.dt.dayofyear.astype('int16')
 
-    data["minute"] = pd.to_datetime(data["timestamp_ms"]*int(
-        1e6)).dt.tz_localize('UTC').dt.tz_convert(timezone).dt.strftime('%M')
+    data["hour"] = localTime.dt.hour.astype('int8')
+
+    data["minute"] = localTime.dt.minute.astype('int8')
 
     return data
 
 
-def getMessages(folderName: str = DEFAULT_ZIP_FOLDER, outputName: str = DEFAULT_OUTPUT_FILE, user: str = USER, timezone: str = TIMEZONE, isAnonymous: bool = ANONYMIZE):
-    dataFrame = getDataFrame(folderName=folderName,
-                             user=user, isAnonymous=isAnonymous)
-    if isinstance(outputName, str):
-        dataFrame.to_csv(outputName, index=False)
+def getMessageLengths(data: pd.DataFrame) -> pd.DataFrame:
+    data["message_length"] = countWordsColumn(data["content"])
+
+    return data
+
+
+def getMessages(folderName: str = DEFAULT_ZIP_FOLDER, cacheDir: str = CACHE_DIR, user: str = USER, timezone: str = TIMEZONE, isAnonymous: bool = ANONYMIZE, incremental: bool = INCREMENTAL):
+    if incremental:
+        exports = getExports(folderName=folderName)
+    else:
+        exports = [getExportPaths(folderName=folderName, user=user)]
+
+    if len(exports) == 0 or exports[0] == None:
+        print("ERROR: put the zip file in ", folderName)
+        return None
+
+    zipPaths = [zipPath for parts in exports for zipPath in parts]
+
+    if isinstance(cacheDir, str):
+        cacheKey = getCacheKey(zipPaths, {"user": user,
+                                          "timezone": timezone,
+                                          "anonymize": isAnonymous,
+                                          "anonymizationSeed": SEED,
+                                          "incremental": incremental})
+        cached = loadMessages(cacheKey, cacheDir)
+
+        if cached is not None:
+            print("Using cached messages")
+            return cached
+
+    if incremental:
+        dataFrame = getIncrementalDataFrame(exports, cacheDir, user)
+
+        if isAnonymous:
+            dataFrame = changeNames(dataFrame)
+    else:
+        dataFrame = getDataFrame(folderName=folderName, user=user,
+                                 isAnonymous=isAnonymous, zipPaths=zipPaths)
+
+    dataFrame = getMessageLengths(dataFrame)
 
     if isinstance(timezone, str):
-        return getDates(dataFrame, timezone)
+        dataFrame = getDates(dataFrame, timezone)
     else:
         print("WARNING: No timezone provided")
-        return dataFrame
+
+    if isinstance(cacheDir, str):
+        saveMessages(dataFrame, cacheKey, cacheDir)
+
+    return dataFrame